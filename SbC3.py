@@ -1,89 +1,311 @@
 # Sb3 to Sb2 Converter 
 # Version 0.2.0
 
-import argparse, logging
-import audioop, io, wave
-import json, hashlib, zipfile
+# Modules only some features need are imported where they are used
+import logging
+import io, mmap
+import json, hashlib, zipfile, zlib
+import os, re, sys, time
+import codecs, contextlib, threading
+from collections import deque
+from concurrent import futures
+
+import sbaudio, sbsvg, sbimage
 
 # Configure the logger for the converter
 logging.basicConfig(format="%(levelname)s: %(message)s", level=30)
 log = logging.getLogger()
 
-# Maps sb3 opcodes and parameters to sb2 blockcodes
-specmap2 = {"motion_movesteps": ["forward:", [["input", "STEPS"]]], "motion_turnright": ["turnRight:", [["input", "DEGREES"]]], "motion_turnleft": ["turnLeft:", [["input", "DEGREES"]]], "motion_pointindirection": ["heading:", [["input", "DIRECTION"]]], "motion_pointtowards": ["pointTowards:", [["input", "TOWARDS"]]], "motion_gotoxy": ["gotoX:y:", [["input", "X"], ["input", "Y"]]], "motion_goto": ["gotoSpriteOrMouse:", [["input", "TO"]]], "motion_glidesecstoxy": ["glideSecs:toX:y:elapsed:from:", [["input", "SECS"], ["input", "X"], ["input", "Y"]]], "motion_changexby": ["changeXposBy:", [["input", "DX"]]], "motion_setx": ["xpos:", [["input", "X"]]], "motion_changeyby": ["changeYposBy:", [["input", "DY"]]], "motion_sety": ["ypos:", [["input", "Y"]]], "motion_ifonedgebounce": ["bounceOffEdge", []], "motion_setrotationstyle": ["setRotationStyle", [["field", "STYLE"]]], "motion_xposition": ["xpos", []], "motion_yposition": ["ypos", []], "motion_direction": ["heading", []], "motion_scroll_right": ["scrollRight", [["input", "DISTANCE"]]], "motion_scroll_up": ["scrollUp", [["input", "DISTANCE"]]], "motion_align_scene": ["scrollAlign", [["field", "ALIGNMENT"]]], "motion_xscroll": ["xScroll", []], "motion_yscroll": ["yScroll", []], "looks_sayforsecs": ["say:duration:elapsed:from:", [["input", "MESSAGE"], ["input", "SECS"]]], "looks_say": ["say:", [["input", "MESSAGE"]]], "looks_thinkforsecs": ["think:duration:elapsed:from:", [["input", "MESSAGE"], ["input", "SECS"]]], "looks_think": ["think:", [["input", "MESSAGE"]]], "looks_show": ["show", []], "looks_hide": ["hide", []], "looks_hideallsprites": ["hideAll", []], "looks_switchcostumeto": ["lookLike:", [["input", "COSTUME"]]], "looks_nextcostume": ["nextCostume", []], "looks_switchbackdropto": ["startScene", [["input", "BACKDROP"]]], "looks_changeeffectby": ["changeGraphicEffect:by:", [["field", "EFFECT"], ["input", "CHANGE"]]], "looks_seteffectto": ["setGraphicEffect:to:", [["field", "EFFECT"], ["input", "VALUE"]]], "looks_cleargraphiceffects": ["filterReset", []], "looks_changesizeby": ["changeSizeBy:", [["input", "CHANGE"]]], "looks_setsizeto": ["setSizeTo:", [["input", "SIZE"]]], "looks_changestretchby": ["changeStretchBy:", [["input", "CHANGE"]]], "looks_setstretchto": ["setStretchTo:", [["input", "STRETCH"]]], "looks_gotofrontback": ["comeToFront", []], "looks_goforwardbackwardlayers": ["goBackByLayers:", [["input", "NUM"]]], "looks_costumenumbername": ["costumeName", []], "looks_backdropnumbername": ["backgroundIndex", []], "looks_size": ["scale", []], "looks_switchbackdroptoandwait": ["startSceneAndWait", [["input", "BACKDROP"]]], "looks_nextbackdrop": ["nextScene", []], "sound_play": ["playSound:", [["input", "SOUND_MENU"]]], "sound_playuntildone": ["doPlaySoundAndWait", [["input", "SOUND_MENU"]]], "sound_stopallsounds": ["stopAllSounds", []], "music_playDrumForBeats": ["playDrum", [["input", "DRUM"], ["input", "BEATS"]]], "music_midiPlayDrumForBeats": ["drum:duration:elapsed:from:", [["input", "DRUM"], ["input", "BEATS"]]], "music_restForBeats": ["rest:elapsed:from:", [["input", "BEATS"]]], "music_playNoteForBeats": ["noteOn:duration:elapsed:from:", [["input", "NOTE"], ["input", "BEATS"]]], "music_setInstrument": ["instrument:", [["input", "INSTRUMENT"]]], "music_midiSetInstrument": ["midiInstrument:", [["input", "INSTRUMENT"]]], "sound_changevolumeby": ["changeVolumeBy:", [["input", "VOLUME"]]], "sound_setvolumeto": ["setVolumeTo:", [["input", "VOLUME"]]], "sound_volume": ["volume", []], "music_changeTempo": ["changeTempoBy:", [["input", "TEMPO"]]], "music_setTempo": ["setTempoTo:", [["input", "TEMPO"]]], "music_getTempo": ["tempo", []], "pen_clear": ["clearPenTrails", []], "pen_stamp": ["stampCostume", []], "pen_penDown": ["putPenDown", []], "pen_penUp": ["putPenUp", []], "pen_setPenColorToColor": ["penColor:", [["input", "COLOR"]]], "pen_changePenHueBy": ["changePenHueBy:", [["input", "HUE"]]], "pen_setPenHueToNumber": ["setPenHueTo:", [["input", "HUE"]]], "pen_changePenShadeBy": ["changePenShadeBy:", [["input", "SHADE"]]], "pen_setPenShadeToNumber": ["setPenShadeTo:", [["input", "SHADE"]]], "pen_changePenSizeBy": ["changePenSizeBy:", [["input", "SIZE"]]], "pen_setPenSizeTo": ["penSize:", [["input", "SIZE"]]], "videoSensing_videoOn": ["senseVideoMotion", [["input", "ATTRIBUTE"], ["input", "SUBJECT"]]], "event_whenflagclicked": ["whenGreenFlag", []], "event_whenkeypressed": ["whenKeyPressed", [["field", "KEY_OPTION"]]], "event_whenthisspriteclicked": ["whenClicked", []], "event_whenbackdropswitchesto": ["whenSceneStarts", [["field", "BACKDROP"]]], "event_whenbroadcastreceived": ["whenIReceive", [["field", "BROADCAST_OPTION"]]], "event_broadcast": ["broadcast:", [["input", "BROADCAST_INPUT"]]], "event_broadcastandwait": ["doBroadcastAndWait", [["input", "BROADCAST_INPUT"]]], "control_wait": ["wait:elapsed:from:", [["input", "DURATION"]]], "control_repeat": ["doRepeat", [["input", "TIMES"], ["input", "SUBSTACK"]]], "control_forever": ["doForever", [["input", "SUBSTACK"]]], "control_if": ["doIf", [["input", "CONDITION"], ["input", "SUBSTACK"]]], "control_if_else": ["doIfElse", [["input", "CONDITION"], ["input", "SUBSTACK"], ["input", "SUBSTACK2"]]], "control_wait_until": ["doWaitUntil", [["input", "CONDITION"]]], "control_repeat_until": ["doUntil", [["input", "CONDITION"], ["input", "SUBSTACK"]]], "control_while": ["doWhile", [["input", "CONDITION"], ["input", "SUBSTACK"]]], "control_for_each": ["doForLoop", [["field", "VARIABLE"], ["input", "VALUE"], ["input", "SUBSTACK"]]], "control_stop": ["stopScripts", [["field", "STOP_OPTION"]]], "control_start_as_clone": ["whenCloned", []], "control_create_clone_of": ["createCloneOf", [["input", "CLONE_OPTION"]]], "control_delete_this_clone": ["deleteClone", []], "control_get_counter": ["COUNT", []], "control_incr_counter": ["INCR_COUNT", []], "control_clear_counter": ["CLR_COUNT", []], "control_all_at_once": ["warpSpeed", [["input", "SUBSTACK"]]], "sensing_touchingobject": ["touching:", [["input", "TOUCHINGOBJECTMENU"]]], "sensing_touchingcolor": ["touchingColor:", [["input", "COLOR"]]], "sensing_coloristouchingcolor": ["color:sees:", [["input", "COLOR"], ["input", "COLOR2"]]], "sensing_distanceto": ["distanceTo:", [["input", "DISTANCETOMENU"]]], "sensing_askandwait": ["doAsk", [["input", "QUESTION"]]], "sensing_answer": ["answer", []], "sensing_keypressed": ["keyPressed:", [["input", "KEY_OPTION"]]], "sensing_mousedown": ["mousePressed", []], "sensing_mousex": ["mouseX", []], "sensing_mousey": ["mouseY", []], "sensing_loudness": ["soundLevel", []], "sensing_loud": ["isLoud", []], "videoSensing_videoToggle": ["setVideoState", [["input", "VIDEO_STATE"]]], "videoSensing_setVideoTransparency": ["setVideoTransparency", [["input", "TRANSPARENCY"]]], "sensing_timer": ["timer", []], "sensing_resettimer": ["timerReset", []], "sensing_of": ["getAttribute:of:", [["field", "PROPERTY"], ["input", "OBJECT"]]], "sensing_current": ["timeAndDate", [["field", "CURRENTMENU"]]], "sensing_dayssince2000": ["timestamp", []], "sensing_username": ["getUserName", []], "sensing_userid": ["getUserId", []], "operator_add": ["+", [["input", "NUM1"], ["input", "NUM2"]]], "operator_subtract": ["-", [["input", "NUM1"], ["input", "NUM2"]]], "operator_multiply": ["*", [["input", "NUM1"], ["input", "NUM2"]]], "operator_divide": ["/", [["input", "NUM1"], ["input", "NUM2"]]], "operator_random": ["randomFrom:to:", [["input", "FROM"], ["input", "TO"]]], "operator_lt": ["<", [["input", "OPERAND1"], ["input", "OPERAND2"]]], "operator_equals": ["=", [["input", "OPERAND1"], ["input", "OPERAND2"]]], "operator_gt": [">", [["input", "OPERAND1"], ["input", "OPERAND2"]]], "operator_and": ["&", [["input", "OPERAND1"], ["input", "OPERAND2"]]], "operator_or": ["|", [["input", "OPERAND1"], ["input", "OPERAND2"]]], "operator_not": ["not", [["input", "OPERAND"]]], "operator_join": ["concatenate:with:", [["input", "STRING1"], ["input", "STRING2"]]], "operator_letter_of": ["letter:of:", [["input", "LETTER"], ["input", "STRING"]]], "operator_length": ["stringLength:", [["input", "STRING"]]], "operator_mod": ["%", [["input", "NUM1"], ["input", "NUM2"]]], "operator_round": ["rounded", [["input", "NUM"]]], "operator_mathop": ["computeFunction:of:", [["field", "OPERATOR"], ["input", "NUM"]]], "data_variable": ["getVar:", [["field", "VARIABLE"]]], "data_setvariableto": ["setVar:to:", [["field", "VARIABLE"], ["input", "VALUE"]]], "data_changevariableby": ["changeVar:by:", [["field", "VARIABLE"], ["input", "VALUE"]]], "data_showvariable": ["showVariable:", [["field", "VARIABLE"]]], "data_hidevariable": ["hideVariable:", [["field", "VARIABLE"]]], "data_listcontents": ["contentsOfList:", [["field", "LIST"]]], "data_addtolist": ["append:toList:", [["input", "ITEM"], ["field", "LIST"]]], "data_deleteoflist": ["deleteLine:ofList:", [["input", "INDEX"], ["field", "LIST"]]], "data_insertatlist": ["insert:at:ofList:", [["input", "ITEM"], ["input", "INDEX"], ["field", "LIST"]]], "data_replaceitemoflist": ["setLine:ofList:to:", [["input", "INDEX"], ["field", "LIST"], ["input", "ITEM"]]], "data_itemoflist": ["getLine:ofList:", [["input", "INDEX"], ["field", "LIST"]]], "data_lengthoflist": ["lineCountOfList:", [["field", "LIST"]]], "data_listcontainsitem": ["list:contains:", [["field", "LIST"], ["input", "ITEM"]]], "data_showlist": ["showList:", [["field", "LIST"]]], "data_hidelist": ["hideList:", [["field", "LIST"]]], "procedures_definition": ["procDef", []], "argument_reporter_string_number": ["getParam", [["field", "VALUE"]]], "procedures_call": ["call", []], "wedo2_motorOnFor": ["LEGO WeDo 2.0.motorOnFor", [["input", "MOTOR_ID"], ["input", "DURATION"]]], "wedo2_motorOn": ["LEGO WeDo 2.0.motorOn", [["input", "MOTOR_ID"]]], "wedo2_motorOff": ["LEGO WeDo 2.0.motorOff", [["input", "MOTOR_ID"]]], "wedo2_startMotorPower": ["LEGO WeDo 2.0.startMotorPower", [["input", "MOTOR_ID"], ["input", "POWER"]]], "wedo2_setMotorDirection": ["LEGO WeDo 2.0.setMotorDirection", [["input", "MOTOR_ID"], ["input", "MOTOR_DIRECTION"]]], "wedo2_setLightHue": ["LEGO WeDo 2.0.setLED", [["input", "HUE"]]], "wedo2_playNoteFor": ["LEGO WeDo 2.0.playNote", [["input", "NOTE"], ["input", "DURATION"]]], "wedo2_whenDistance": ["LEGO WeDo 2.0.whenDistance", [["input", "OP"], ["input", "REFERENCE"]]], "wedo2_whenTilted": ["LEGO WeDo 2.0.whenTilted", [["input", "TILT_DIRECTION_ANY"]]], "wedo2_getDistance": ["LEGO WeDo 2.0.getDistance", []], "wedo2_isTilted": ["LEGO WeDo 2.0.isTilted", [["input", "TILT_DIRECTION_ANY"]]], "wedo2_getTiltAngle": ["LEGO WeDo 2.0.getTilt", [["input", "TILT_DIRECTION"]]], "event_whengreaterthan": ["whenSensorGreaterThan", [["field", "WHENGREATERTHANMENU"], ["input", "VALUE"]]]}
+# Maps sb3 opcodes and parameters to sb2 blockcodes, generated by specmap.py
+specmapFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "specmap2.json")
+_specmaps = {} # Loaded specmaps by path, each is only read once per process
+
+def loadSpecmap(path=""):
+    """Returns the sb3 to sb2 specmap, loading it the first time.
+
+    path -- the specmap json, defaults to specmap2.json next to this file"""
+    path = path or specmapFile
+    if not path in _specmaps:
+        try:
+            with open(path, "r") as f:
+                _specmaps[path] = json.load(f)
+        except:
+            log.critical("Failed to load specmap '%s'.", path)
+            raise
+    return _specmaps[path]
 
-def main(sb3_path, sb2_path, overwrite=False, optimize=False, debug=False):
+def __getattr__(name):
+    # Keep SbC3.specmap2 working without loading it on import
+    if name == "specmap2":
+        return loadSpecmap()
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+def main(sb3_path, sb2_path, overwrite=False, optimize=False, debug=False, cache=None, converter=None, profiler=None, stats=None, specmap_path="", **options):
     """Automatically converts a sb3 file and saves it in sb2 format.
     
-    sb3_path -- the path to the .sb3 file
-    sb2_path -- the save path for the .sb2 file
+    sb3_path -- the path to the .sb3 file, its bytes or a file object
+    sb2_path -- the save path for the .sb2 file or a writable file object
     specmap_path -- change the load path for the sb3 to sb2 specmap
     overwrite -- allow overwriting existing files
     debug -- save a debug to project.json if overwrite is enabled
-    optimize -- try to convert strings to numbers"""
-
-    # Open files to read and write from
-    sbf = SbFiles(sb3_path, sb2_path, overwrite, debug)
-
-    # Verify they loaded
-    if sbf.sb3_file and sbf.sb2_file:
-        if sbf.json_path == "project.json":
-            # Load the sb3 project json
-            sb3 = sbf.getSb3()
-
-            # Make sure everything loaded correctly
-            if sb3:
-                # Get the convertor object
-                project = Converter(sb3, specmap2)
-
-                # Set optimizations
-                project.numberOpt = optimize
-                project.spaceOpt = optimize
-
-                # Convert the project
-                sb2, filemap = project.convert()
+    optimize -- try to convert strings to numbers
+    cache -- an AssetCache or folder path for reusing converted sounds
+    converter -- a Converter to reuse instead of creating one
+    profiler -- a Profiler to record the time and memory of each phase
+    stats -- a dict to fill with statistics about the project and conversion
+    options -- other keyword arguments for SbFiles, such as quality
+
+    Returns True if the file was converted and saved."""
+    success = False
+    counts = {} # Statistics from the converter
+    start = time.perf_counter()
+    if profiler:
+        profiler.start()
+    sbf = None
+    try:
+        phase = profiler and profiler.phase or _noPhase
+
+        # Open files to read and write from
+        if type(cache) == str:
+            cache = AssetCache(cache)
+        with phase("open"):
+            sbf = SbFiles(sb3_path, sb2_path, overwrite, debug, cache=cache, **options)
+        sbf.profiler = profiler
+
+        # Verify they loaded
+        if sbf.sb3_file and sbf.sb2_file:
+            if sbf.json_path == "project.json":
+                # Load the sb3 project json
+                with phase("getSb3"):
+                    sb3 = sbf.getSb3()
+
+                # Make sure everything loaded correctly
+                if sb3:
+                    # Get the convertor object
+                    if converter:
+                        project = converter
+                        project.reset(sb3)
+                    else:
+                        project = Converter(sb3, loadSpecmap(specmap_path))
 
-                # Save the project
-                sbf.saveSb2(sb2, filemap)
+                    # Set optimizations
+                    project.numberOpt = optimize
+                    project.spaceOpt = optimize
+                    project.profiler = profiler
+                    project.store = cache
 
-                # Close all the files
-                sbf.close()
+                    try:
+                        # Convert the project
+                        with phase("convert"):
+                            sb2, filemap = project.convert()
+
+                        # Save the project
+                        with phase("saveSb2"):
+                            success = sbf.saveSb2(sb2, filemap)
+                        counts = project.stats
+                    except json.decoder.JSONDecodeError:
+                        # Streamed targets are only parsed while converting
+                        log.warning("File '%s/%s' is not a valid json file.", sbf.sb3_name, sbf.json_path)
+                        log.critical("Failed to load sb3 project json.")
+
+                    # Close all the files
+                    with phase("close"):
+                        sbf.close()
+                else:
+                    log.critical("Failed to load sb3 project json.")
+                    sbf.close()
+            elif sbf.json_path == "sprite.json":
+                # Load the sb3 target json
+                with phase("getSb3"):
+                    sb3 = sbf.getSb3()
+
+                if sb3:
+                    # Get the convertor object
+                    if converter:
+                        sprite = converter
+                        sprite.reset()
+                    else:
+                        sprite = Converter(None, loadSpecmap(specmap_path))
+
+                    # Set optimizations
+                    sprite.numberOpt = optimize
+                    sprite.spaceOpt = optimize
+                    sprite.profiler = profiler
+                    sprite.store = cache
+
+                    # Convert the sprite
+                    with phase("convert"), phase("parseTarget", sb3.get("name")):
+                        sb2 = sprite.convertTarget(sb3)
+                    filemap = sprite.filemap
+
+                    # Save the sprite
+                    with phase("saveSb2"):
+                        success = sbf.saveSb2(sb2, filemap)
+                    counts = sprite.stats
+
+                    # Close all files
+                    with phase("close"):
+                        sbf.close()
+                else:
+                    log.critical("Failed to load sb3 sprite json.")
+                    sbf.close()
             else:
-                log.critical("Failed to load sb3 project json.")
+                log.error("Invalid json path.")
                 sbf.close()
-        elif sbf.json_path == "sprite.json":
-            # Load the sb3 target json
-            sb3 = sbf.getSb3()
-
-            if sb3:
-                # Get the convertor object
-                sprite = Converter(None, specmap2)
-
-                # Set optimizations
-                sprite.numberOpt = optimize
-                sprite.spaceOpt = optimize
+        else:
+            log.critical("Failed to load sb3 and sb2 files.")
+            sbf.close()
 
-                # Convert the sprite
-                sb2 = sprite.parseTarget(sb3)
-                filemap = sprite.filemap
+        if cache:
+            log.info("Asset cache: %i hits, %i misses.", cache.hits, cache.misses)
+        if stats != None:
+            # Record the project shape and cost
+            stats.update({"sb3": sbf.sb3_name, "sb2": sbf.sb2_name, "success": success,
+                "sb3Size": _size(sbf.sb3_path), "sb2Size": success and _size(sbf.sb2_path) or 0})
+            stats.update(counts)
+            stats.update(sbf.stats)
+            stats["elapsed"] = round(time.perf_counter() - start, 6)
+    finally:
+        # Always stop profiling, tracemalloc slows everything while tracing
+        if sbf:
+            sbf.close()
+        if converter:
+            converter.reset() # Free the project until the converter is reused
+        if profiler:
+            profiler.stop()
+
+    return success
+
+def convertBytes(sb3, optimize=False, **options):
+    """Converts a sb3 in memory without any temporary files.
+
+    sb3 -- the sb3 bytes or a readable and seekable file object, like an mmap
+    options -- other keyword arguments for main, such as converter or quality
+
+    Returns the sb2 bytes, or None if it failed."""
+    sb2 = io.BytesIO()
+    if not convertStream(sb3, sb2, optimize, **options):
+        return None
+    return sb2.getvalue()
+
+def convertStream(sb3, sb2, optimize=False, **options):
+    """Converts a sb3 in memory and writes the sb2 to a file object.
+
+    sb3 -- the sb3 bytes or a readable and seekable file object, like an mmap
+    sb2 -- a writable file object, it does not need to be seekable
+    options -- other keyword arguments for main, such as converter or quality
+
+    Returns True if the sb2 was written."""
+    return main(sb3, sb2, True, optimize, **options)
+
+def _size(file):
+    """Returns the size of a path, bytes or file object, or None if unknown."""
+    try:
+        if type(file) == str:
+            return os.path.getsize(file)
+        elif hasattr(file, "__len__"):
+            return len(file)
+        elif hasattr(file, "getbuffer"):
+            return file.getbuffer().nbytes
+        try:
+            return file.seek(0, 2)
+        except OSError:
+            return file.tell() # The end of a stream which was just written
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def saveStats(stats_path, stats):
+    """Appends the statistics of a conversion to a json lines file."""
+    with open(stats_path, "a") as f:
+        f.write(json.dumps(stats) + "\n")
+
+def findProjects(paths):
+    """Expands files, directories and glob patterns into a list of sb3 paths.
+
+    Directories are searched recursively for .sb3 and .sprite3 files."""
+    sb3_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in files:
+                    if name.split(".")[-1] in ["sb3", "sprite3"]:
+                        found.append(os.path.join(root, name))
+            sb3_paths += sorted(found)
+        elif any(c in path for c in "*?["):
+            import glob
+            sb3_paths += sorted(glob.glob(path, recursive=True))
+        else:
+            sb3_paths.append(path)
+    return sb3_paths
 
-                # Save the sprite
-                sbf.saveSb2(sb2, filemap)
+def convertMany(sb3_paths, sb2_dir="", workers=None, overwrite=False, optimize=False, cache=None, stats_path="", **options):
+    """Converts many sb3 files using a pool of worker processes.
 
-                # Close all files
-                sbf.close()
+    sb3_paths -- the paths to the .sb3 or .sprite3 files
+    sb2_dir -- save the results to this folder instead of next to each sb3
+    workers -- the number of worker processes, defaults to the cpu count
+    overwrite -- allow overwriting existing files
+    optimize -- try to convert strings to numbers
+    cache -- an AssetCache or folder path shared by the workers
+    stats_path -- append the statistics of each file to this json lines file
+    options -- other keyword arguments for SbFiles, such as quality
+
+    Yields a (sb3_path, success) tuple for each file in the given order."""
+    jobs = []
+    for sb3_path in sb3_paths:
+        sb2_path = ""
+        if sb2_dir:
+            # Keep the name of the sb3 file
+            name = os.path.basename(sb3_path).split(".")
+            if len(name) > 1 and name[-1] == "sprite3":
+                name[-1] = "sprite2"
+            elif len(name) > 1:
+                name[-1] = "sb2"
             else:
-                log.critical("Failed to load sb3 sprite json.")
-                sbf.close()
-        else:
-            log.error("Invalid json path.")
-            sbf.close()
-    else:
-        log.critical("Failed to load sb3 and sb2 files.")
-        sbf.close()
+                name.append("sb2")
+            sb2_path = os.path.join(sb2_dir, ".".join(name))
+        jobs.append((sb3_path, sb2_path, dict(options,
+            overwrite=overwrite, optimize=optimize, cache=cache)))
+
+    if sb2_dir:
+        os.makedirs(sb2_dir, exist_ok=True)
+
+    from concurrent.futures.process import BrokenProcessPool
+    with futures.ProcessPoolExecutor(workers, initializer=_initWorker,
+            initargs=(log.level,)) as pool:
+        results = [pool.submit(_convertJob, job) for job in jobs]
+        for job, result in zip(jobs, results):
+            try:
+                success, stats = result.result()
+            except BrokenProcessPool:
+                # A worker died, so this and every unfinished file failed
+                log.error("A worker stopped unexpectedly while converting '%s'.", job[0])
+                success, stats = False, {"sb3": job[0], "success": False}
+            if stats_path:
+                saveStats(stats_path, stats)
+            yield job[0], success
+
+def _initWorker(level):
+    """Configures the logger of a batch worker process."""
+    log.level = level
+
+def _convertJob(job):
+    """Converts a single file for convertMany, never raises.
+
+    Returns whether it succeeded and the statistics of the conversion."""
+    stats = {}
+    try:
+        return main(job[0], job[1], stats=stats, **job[2]), stats
+    except:
+        log.error("Unkown error converting '%s'.", job[0], exc_info=True)
+        return False, dict(stats, sb3=job[0], success=False)
 
 class SbFiles:
     supportedRates = [44100, 22050, 11025, 5512] # Sound rates supported by flash
+    supportedWidths = [1, 2] # Sample widths supported by flash
+    quality = "fast" # Resampling quality, see sbaudio.qualities
 
     sb3_file = None # Holds the sb3 file
     sb2_file = None # Holds the sb2 file
@@ -95,27 +317,84 @@ class SbFiles:
     overwrite = False # Whether files may be overwritten
     debug = False # Whether to save a debug json
 
-    def __init__(self, sb3_path, sb2_path="", overwrite=False, debug=False):
-        """Opens the sb3 and sb2 files in preperation of use"""
+    bufferSize = 64 * 1024 # Chunk size used when copying assets
+    cache = None # An AssetCache for converted sounds
+
+    workers = None # Number of asset processing threads, defaults to the cpu count
+    maxPending = 16 # Most processed assets waiting to be saved
+
+    compressions = {"stored": zipfile.ZIP_STORED, "deflate": zipfile.ZIP_DEFLATED}
+    compression = "stored" # How to compress the sb2 zip
+    compressLevel = None # Deflate level from 0 to 9, defaults to 6
+    storedFormats = ["png", "mp3"] # Already compressed formats which are never deflated
+    compact = True # Save the sb2 json without indentation
+    stream = False # Parse the targets of a project json one at a time
+    profiler = None # Records the time and memory of each phase if set
+    progress = None # Called with the kind and name of each processed asset if set
+    integrities = ["off", "trust", "full"] # How much asset md5s are checked
+    integrity = "trust" # Only hash assets with ids which are not md5s
+    md5Pattern = re.compile(r"[0-9a-f]{32}")
+    memo = None # A Memo of converted costumes by source md5, shared by every SbFiles
+    downscale = False # Halve bitmaps with a resolution of 2
+    pngLevel = None # Deflate png costumes again at this level if set
+
+    def __init__(self, sb3_path, sb2_path="", overwrite=False, debug=False, bufferSize=None, cache=None, workers=None, quality=None, compression=None, compressLevel=None, compact=True, stream=False, integrity=None, downscale=False, pngLevel=None):
+        """Opens the sb3 and sb2 files in preperation of use
+
+        The sb3 may also be bytes or a readable and seekable file object such
+        as an mmap, and the sb2 may be a writable file object."""
+        # Bytes and file objects are converted in memory
+        if isinstance(sb3_path, (bytes, bytearray, memoryview)):
+            sb3_path = io.BytesIO(sb3_path)
+        elif isinstance(sb3_path, mmap.mmap):
+            sb3_path = MappedFile(sb3_path)
         self.sb3_path = sb3_path
         self.sb2_path = sb2_path
+        self.sb3_name = type(sb3_path) == str and sb3_path or "<sb3 stream>"
+        self.sb2_name = type(sb2_path) == str and sb2_path or "<sb2 stream>"
+        if not sb2_path and type(sb3_path) != str:
+            raise ValueError("A sb2 path or file object is needed to convert a sb3 stream.")
+        self.cache = cache
+        self.workers = workers
+        if quality:
+            self.quality = quality
+        if compression:
+            self.compression = compression
+        if compressLevel != None:
+            self.compressLevel = compressLevel
+        self.compact = compact
+        self.stream = stream
+        if integrity:
+            if not integrity in self.integrities:
+                raise ValueError("Unkown integrity mode '%s'." % integrity)
+            self.integrity = integrity
+        self.downscale = downscale
+        self.pngLevel = pngLevel
+        if downscale and not sbimage.loadPillow():
+            log.warning("Downscaling bitmaps needs Pillow, they will only be recompressed.")
+        self.halved = set() # Costumes which were downscaled
+        self.moved = {} # Offsets of svg costumes which were moved to 0,0
+        if bufferSize:
+            self.bufferSize = bufferSize
+        self.stats = {"sounds": 0, "soundsConverted": 0, "soundsCopied": 0, "soundsSkipped": {}, "costumes": 0,
+            "duplicates": 0}
 
         try:
             self.sb3_file = zipfile.ZipFile(sb3_path, "r")
 
             # Figure out if the sb3 is a project or sprite
-            ext = sb3_path.split(".")[-1]
+            ext = self.sb3_name.split(".")[-1]
             files = self.sb3_file.namelist()
             if ext == "sb3":
                 self.json_path = "project.json"
                 if not "project.json" in files and "sprite.json" in files:
                     self.json_path = "sprite.json"
-                    log.warning("File '%s' has a sb3 extension but appears to be a sprite." % sb3_path)
+                    log.warning("File '%s' has a sb3 extension but appears to be a sprite." % self.sb3_name)
             elif ext == "sprite3":
                 self.json_path = "sprite.json"
                 if not "sprite.json" in files and "project.json" in files:
                     self.json_path = "project.json"
-                    log.warning("File '%s' has a sprite3 extension but appears to be a project." % sb3_path)
+                    log.warning("File '%s' has a sprite3 extension but appears to be a project." % self.sb3_name)
             else:
                 self.json_path = "project.json"
                 if not "project.json" in files and "sprite.json" in files:
@@ -131,20 +410,22 @@ class SbFiles:
                     sb2_path = sb3_path.split(".")
                     sb2_path[-1] = "sprite2"
                     self.sb2_path = '.'.join(sb2_path)
+                self.sb2_name = self.sb2_path
 
             # Create the save file
-            if overwrite:
-                self.sb2_file = zipfile.ZipFile(self.sb2_path, "w")
+            compression = self.compressions[self.compression]
+            if type(self.sb2_path) != str or overwrite:
+                self.sb2_file = zipfile.ZipFile(self.sb2_path, "w", compression, compresslevel=self.compressLevel)
             else:
-                self.sb2_file = zipfile.ZipFile(self.sb2_path, "x")
+                self.sb2_file = zipfile.ZipFile(self.sb2_path, "x", compression, compresslevel=self.compressLevel)
         except FileExistsError:
-            log.warning("File '%s' already exists. Delete or rename it and try again." % sb2_path)
+            log.warning("File '%s' already exists. Delete or rename it and try again." % self.sb2_name)
         except FileNotFoundError:
-            log.warning("File '%s' not found." % sb3_path)
+            log.warning("File '%s' not found." % self.sb3_name)
         except zipfile.BadZipFile:
-            log.warning("File '%s' is not a valid zip file." % sb3_path)
+            log.warning("File '%s' is not a valid zip file." % self.sb3_name)
         except:
-            log.error("Unkown error opening file '%s' or '%s'." % (sb2_path, sb3_path), exc_info=True)
+            log.error("Unkown error opening file '%s' or '%s'." % (self.sb2_name, self.sb3_name), exc_info=True)
 
         self.overwrite = overwrite
         self.debug = debug
@@ -152,191 +433,1062 @@ class SbFiles:
     def getSb3(self):
         """Return the parsed project json from the sb3 file."""
         try:
+            if (self.stream or self.cache) and self.json_path == "project.json":
+                # Targets in the cache are found by a hash of their json
+                return self.streamSb3(self.sb3_file.open(self.json_path), bool(self.cache))
             sb3_json = self.sb3_file.read(self.json_path)
             sb3 = json.loads(sb3_json)
             return sb3
         except KeyError:
-            log.warning("Failed to find json '%s' in '%s'.", self.json_path, self.sb3_path)
+            log.warning("Failed to find json '%s' in '%s'.", self.json_path, self.sb3_name)
             return False
         except json.decoder.JSONDecodeError:
-            log.warning("File '%s/%s' is not a valid json file.", self.sb3_path, self.json_path)
+            log.warning("File '%s/%s' is not a valid json file.", self.sb3_name, self.json_path)
             return False
         except:
-            log.error("Unkown error reading '%s'.", self.sb3_path, exc_info=True)
+            log.error("Unkown error reading '%s'.", self.sb3_name, exc_info=True)
         return False
 
+    def streamSb3(self, stream, fingerprint=False):
+        """Return the project json with the targets parsed one at a time.
+
+        "targets" is an iterator which reads and parses each target from
+        the binary file object when it is reached, so only the target
+        being parsed is held as text. The other keys are added to the
+        project as they are parsed, so keys after the targets are only
+        there once the iterator is finished.
+
+        fingerprint -- add the md5 of each target's json to the target"""
+        project = {}
+        project["targets"] = self.iterTargets(JsonReader(stream, self.bufferSize), project, fingerprint)
+        return project
+
+    def iterTargets(self, reader, project, fingerprint=False):
+        """Parses a project json into project, yielding each target."""
+        try:
+            # Read the keys of the project object
+            reader.skip("{")
+            while reader.peek() != "}":
+                key = reader.decode()
+                reader.skip(":")
+
+                if key == "targets" and reader.peek() == "[":
+                    reader.skip("[")
+                    while reader.peek() != "]":
+                        target = reader.decode()
+                        if fingerprint:
+                            text = reader.text[reader.start:reader.index]
+                            target["fingerprint"] = hashlib.md5(text.encode("utf-8")).hexdigest()
+                            text = None
+                        reader.skip(",", "]")
+                        yield target
+                        target = None
+                    reader.skip("]")
+                else:
+                    project[key] = reader.decode()
+                reader.skip(",", "}")
+        finally:
+            reader.close()
+
     def saveSb2(self, sb2, filemap):
         """Create and save a sb2 zip from the converted project and sb3 zip."""
         sb2_jfile = None
 
         # Save the results
         try:
-            # Process all sounds
-            for s in filemap[0]:
-                log.debug("Processing sound '%s'.", s)
-
-                # Get the sb3 asset
-                asset = filemap[0][s]
-                name = asset[0]["name"]
-                format = asset[0]["dataFormat"]
-                md5ext = asset[0]["md5ext"]
-                md5 = asset[0]["assetId"]
-
-                # Get the sb2 asset
-                data = self.sb3_file.read(md5ext)
-                assetId = asset[1]["soundID"]
-
-                if format == "wav":
-                    # 
-                    try:
-                        data = self.processWave(data, asset[1])
-                        md5 = hashlib.md5(data).hexdigest()
-                    except wave.Error:
-                        log.warning("Failed to convert wav sound '%s'." %asset[0]["name"], exc_info=True)
-                    except:
-                        log.error("Unkown error converting sound '%s'." %asset[0]["assetId"], exc_info=True)
-                elif format == "mp3":
-                    log.warning("Sound conversion for mp3 '%s' not supported." %asset[0]["name"])
-                    continue
-                else:
-                    log.warning("Unrecognized sound format '%s'." %format)
-
-                # Save the sb2 asset
-                asset[1]["md5"] = md5 + "." + format
-                fileName2 = str(assetId) + "." + format
-                self.sb2_file.writestr(fileName2, data)
-            
-            # Process all costumes
-            for c in filemap[1]:
-                log.debug("Processing costume '%s'.", c)
-
-                # Get the sb3 asset
-                asset = filemap[1][c]
-                assetId = asset[0]["assetId"]
-                name = asset[0]["name"]
-                format = asset[0]["dataFormat"]
-                md5ext = asset[0]["md5ext"]
-
-                # Load the sb3 asset
-                assetData = self.sb3_file.read(md5ext)
-                    
-
-                # Check the format
-                if format == "png":
-                    pass
-                elif format == "svg":
-                    pass # TODO svg repair
-                else:
-                    log.warning("Unrecognized file format '%s'" % format)
-
-                # Check the file md5
-                md5 = hashlib.md5(assetData).hexdigest()
-                if md5 != assetId:
-                    if assetId == asset[0]["assetId"]:
-                        log.warning("The md5 for %s '%s' is invalid.", format, name)
-                    else:
-                        log.error("The md5 for asset '%s' is invalid.", group[id][0]["assetId"])
-                
-                # Save sb2 assetId info
-                assetId2 = asset[1]["baseLayerID"]
-                asset[1]["baseLayerMD5"] = assetId + "." + format
-
-                # Save the sb2 asset
-                fileName2 = str(assetId2) + "." + format
-                self.sb2_file.writestr(fileName2, assetData)
-
-            # Get the sb2 json string
-            sb2_json = json.dumps(sb2, indent=4, separators=(',', ': '))
+            with futures.ThreadPoolExecutor(self.workers) as pool:
+                # Hash the assets and give identical ones the same sb2 id
+                with self.phase("hash"):
+                    md5s = self.md5s = self.hashAssets(pool, filemap)
+                    duplicates = self.dedupAssets(filemap, md5s)
+
+                # Save all sounds as they finish processing
+                with self.phase("sounds"):
+                    ids = [s for s in filemap[0] if not s in duplicates[0]]
+                    sounds = self.mapAssets(pool, self.processSound, [filemap[0][s] for s in ids])
+                    for s, result in zip(ids, sounds):
+                        # Get the processed asset
+                        asset = filemap[0][s]
+                        format = asset[0]["dataFormat"]
+                        self.countSound(asset, result)
+                        if self.progress:
+                            self.progress("sound", asset[0]["name"])
+                        if result == None:
+                            continue # Not supported
+                        log.debug("Saving sound '%s'.", s)
+                        data, md5 = result
+
+                        # Save the sb2 asset
+                        fileName2 = str(asset[1]["soundID"]) + "." + format
+                        self.writeAsset(asset[0]["md5ext"], fileName2, data)
+                        asset[1]["md5"] = (md5 or md5s[0][s]) + "." + format
+
+                # Save all costumes as they finish processing
+                with self.phase("costumes"):
+                    ids = [c for c in filemap[1] if not c in duplicates[1]]
+                    costumes = self.mapAssets(pool, self.processCostume, [filemap[1][c] for c in ids])
+                    for c, result in zip(ids, costumes):
+                        log.debug("Saving costume '%s'.", c)
+
+                        # Get the sb3 asset
+                        asset = filemap[1][c]
+                        format = asset[0]["dataFormat"]
+                        if self.progress:
+                            self.progress("costume", asset[0]["name"])
+
+                        # Save the sb2 asset
+                        fileName2 = str(asset[1]["baseLayerID"]) + "." + format
+                        data, md5 = result
+                        self.writeAsset(asset[0]["md5ext"], fileName2, data)
+
+                        # Save sb2 assetId info
+                        asset[1]["baseLayerMD5"] = (md5 or md5s[1][c]) + "." + format
+                        self.stats["costumes"] += 1
+
+                # Point duplicates at the saved asset
+                for s in duplicates[0]:
+                    sound2 = filemap[0][duplicates[0][s]][1]
+                    for key in ["soundID", "md5", "rate", "sampleCount"]:
+                        filemap[0][s][1][key] = sound2[key]
+                for c in duplicates[1]:
+                    costume2 = filemap[1][duplicates[1][c]][1]
+                    for key in ["baseLayerID", "baseLayerMD5"]:
+                        filemap[1][c][1][key] = costume2[key]
+                    if duplicates[1][c] in self.halved and filemap[1][c][1].get("bitmapResolution") == 2:
+                        self.halveCostume(filemap[1][c][1])
+                    if duplicates[1][c] in self.moved:
+                        self.moveCostume(filemap[1][c][1], self.moved[duplicates[1][c]])
 
             if self.debug and self.overwrite:
-                # Save a copy of the json
+                # Save a readable copy of the json
                 sb2_jfile = open(self.json_path, "w")
-                sb2_jfile.write(sb2_json)
+                json.dump(sb2, sb2_jfile, indent=4, separators=(',', ': '))
                 print("Saved debug to '%s'." % self.json_path)
             
             # Save the sb2 json
-            self.sb2_file.writestr(self.json_path, sb2_json)
+            with self.phase("writeJson"), self.sb2_file.open(self.entryInfo(self.json_path), "w") as f:
+                if self.compact:
+                    self.writeJson(sb2, f)
+                else:
+                    f.write(json.dumps(sb2, indent=4, separators=(',', ': ')).encode("utf-8"))
 
-            print("Saved to '%s'" % self.sb2_path)
+            if type(self.sb2_path) == str:
+                print("Saved to '%s'" % self.sb2_path)
             return True
+        except futures.CancelledError:
+            raise # Stopped by AsyncConverter
         except:
-            log.error("Unkown error saving to '%s'.", sb2_path, exc_info=True)
+            log.error("Unkown error saving to '%s'.", self.sb2_name, exc_info=True)
             return False
         finally:
             if sb2_jfile: sb2_jfile.close()
             elif self.debug: print("Did not save debug json to '%s'." % self.json_path)
 
+    def hashAssets(self, pool, filemap):
+        """Returns the md5s of the sounds and costumes by their assetId.
+
+        With integrity off the assetIds are used as md5s. With trust only
+        assets with ids that are not md5s are hashed. With full every asset
+        is hashed and checked against its id. Hashing runs on the pool."""
+        md5s = [{}, {}]
+        self.hashed = [set(), set()] # AssetIds with md5s of their actual data
+        hashing = []
+        for kind in range(2):
+            for assetId in filemap[kind]:
+                if self.integrity == "full" or (self.integrity == "trust"
+                        and not self.md5Pattern.fullmatch(assetId)):
+                    hashing.append((kind, assetId))
+                else:
+                    md5s[kind][assetId] = assetId
+
+        results = pool.map(self.hashAsset, [filemap[kind][assetId][0]["md5ext"] for kind, assetId in hashing])
+        for (kind, assetId), md5 in zip(hashing, results):
+            if md5 != assetId:
+                asset = filemap[kind][assetId][0]
+                log.warning("The md5 for %s '%s' is invalid.", asset["dataFormat"], asset["name"])
+            md5s[kind][assetId] = md5
+            self.hashed[kind].add(assetId)
+        return md5s
+
+    def hashAsset(self, md5ext):
+        """Returns the md5 of an asset in the sb3, reading it in chunks."""
+        md5 = hashlib.md5()
+        with self.sb3_file.open(md5ext) as f:
+            chunk = f.read(self.bufferSize)
+            while chunk:
+                md5.update(chunk)
+                chunk = f.read(self.bufferSize)
+        return md5.hexdigest()
+
+    def dedupAssets(self, filemap, md5s):
+        """Gives sounds and costumes with the same md5 and format one sb2 id.
+
+        Returns dicts for sounds and costumes of the duplicate assetIds
+        and the assetId of the asset which is saved for them."""
+        duplicates = [{}, {}]
+        for kind, field in [(0, "soundID"), (1, "baseLayerID")]:
+            saved = {} # The first assetId with each md5 and format
+            for assetId in filemap[kind]:
+                asset = filemap[kind][assetId]
+                content = (md5s[kind][assetId], asset[0]["dataFormat"])
+                if kind == 1 and self.downscale:
+                    content += (asset[1].get("bitmapResolution"),) # Only some may be halved
+                if content in saved:
+                    duplicates[kind][assetId] = saved[content]
+                    asset[1][field] = filemap[kind][saved[content]][1][field]
+                else:
+                    asset[1][field] = len(saved)
+                    saved[content] = assetId
+        self.stats["duplicates"] += len(duplicates[0]) + len(duplicates[1])
+        return duplicates
+
+    def countSound(self, asset, result):
+        """Counts a processed sound in the statistics."""
+        self.stats["sounds"] += 1
+        skipped = self.stats["soundsSkipped"]
+        if asset[1].get("format") == "adpcm":
+            skipped["adpcm"] = skipped.get("adpcm", 0) + 1 # Copied unchecked
+        elif result == None:
+            format = asset[0]["dataFormat"]
+            skipped[format] = skipped.get(format, 0) + 1 # Not saved
+        elif result[1] == None:
+            self.stats["soundsCopied"] += 1
+        else:
+            self.stats["soundsConverted"] += 1
+
+    def writeJson(self, sb2, f):
+        """Writes compact json to a binary file one sprite at a time.
+
+        The output is the same as json.dumps(sb2, separators=(',', ':'))."""
+        encode = json.JSONEncoder(separators=(",", ":")).encode
+        f.write(b"{")
+        for i, key in enumerate(sb2):
+            if i:
+                f.write(b",")
+            f.write((encode(key) + ":").encode("utf-8"))
+
+            value = sb2[key]
+            if type(value) == list:
+                # Encode children and other lists piece by piece
+                f.write(b"[")
+                for j, item in enumerate(value):
+                    if j:
+                        f.write(b",")
+                    f.write(encode(item).encode("utf-8"))
+                f.write(b"]")
+            else:
+                f.write(encode(value).encode("utf-8"))
+        f.write(b"}")
+
+    def mapAssets(self, pool, func, assets):
+        """Yields func(asset) for each asset in order, running ahead on the pool."""
+        pending = deque()
+        for asset in assets:
+            pending.append(pool.submit(func, asset))
+
+            # Limit how many processed assets are held in memory
+            if len(pending) > self.maxPending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def processSound(self, asset):
+        """Prepares a sound for saving, runs on a worker thread.
+
+        Returns None if the sound should not be saved, otherwise the
+        converted data and its md5. If the md5 is None the sound is
+        saved unchanged with the md5 found by hashAssets. The data is
+        deflated here if its sb2 entry is compressed, see deflateAsset."""
+        with self.phase("processSound"):
+            result = self.checkSound(asset)
+        return result and (self.deflateAsset(asset, result[0]), result[1])
+
+    def checkSound(self, asset):
+        """Checks the format of a sound and converts it if needed."""
+        log.debug("Processing sound '%s'.", asset[0]["assetId"])
+        format = asset[0]["dataFormat"]
+
+        if format == "wav" and asset[1]["format"] == "adpcm":
+            log.warning("Sound rate verification for adpcm wav '%s' not supported." % asset[1]["soundName"])
+            return None, None
+        elif format == "wav":
+            import wave
+            try:
+                # Check the headers for sounds which can be copied unchanged
+                try:
+                    with self.sb3_file.open(asset[0]["md5ext"]) as f:
+                        header = sbaudio.readHeader(f)
+                except ValueError:
+                    header = None # Let wave report the problem
+                if header and header["format"] == 1 and header["channels"] == 1 and \
+                        self.supportedFormat(header["rate"], header["width"]) == (header["rate"], header["width"]):
+                    asset[1]["rate"] = header["rate"]
+                    asset[1]["sampleCount"] = header["sampleCount"]
+                    return None, None
+
+                return self.convertWave(self.sb3_file.read(asset[0]["md5ext"]), asset[1])
+            except (wave.Error, EOFError): # Truncated wavs raise EOFError
+                log.warning("Failed to convert wav sound '%s'." %asset[0]["name"], exc_info=True)
+            except:
+                log.error("Unkown error converting sound '%s'." %asset[0]["assetId"], exc_info=True)
+        elif format == "mp3":
+            log.warning("Sound conversion for mp3 '%s' not supported." %asset[0]["name"])
+            return None
+        else:
+            log.warning("Unrecognized sound format '%s'." %format)
+
+        return None, None
+
+    def processCostume(self, asset):
+        """Prepares a costume for saving, runs on a worker thread.
+
+        Returns the converted data and its md5. If the md5 is None the
+        costume is saved unchanged with the md5 found by hashAssets. The
+        data is deflated here if its sb2 entry is compressed."""
+        data, md5 = self.checkCostume(asset) or (None, None)
+        return self.deflateAsset(asset, data), md5
+
+    def checkCostume(self, asset):
+        """Returns a converted costume and its md5, or None if it is copied unchanged."""
+        log.debug("Processing costume '%s'.", asset[0]["assetId"])
+        format = asset[0]["dataFormat"]
+
+        # Check the format
+        if format == "png":
+            downscale = self.downscale and asset[1].get("bitmapResolution") == 2
+            if downscale or self.pngLevel != None:
+                with self.phase("processBitmap"):
+                    result = self.convertCostume(asset, self.convertBitmap, "png",
+                        sbimage.version, self.pngLevel, downscale)
+                if result and result[2]["halved"]:
+                    self.halveCostume(asset[1])
+                    self.halved.add(asset[0]["assetId"])
+                return result and result[:2]
+        elif format == "svg":
+            with self.phase("processSvg"):
+                result = self.convertCostume(asset, self.convertSvg, "svg", sbsvg.version)
+            if result and any(result[2]["offset"]):
+                self.moveCostume(asset[1], result[2]["offset"])
+                self.moved[asset[0]["assetId"]] = result[2]["offset"]
+            return result and result[:2]
+        else:
+            log.warning("Unrecognized file format '%s'" % format)
+
+    def convertCostume(self, asset, convert, *params):
+        """Returns a converted costume, its md5 and changes to its info, or None if unchanged.
+
+        convert(f, *params) reads the costume from a file object and returns
+        the data and a dict of changes, such as whether it was halved. Results
+        are kept by source md5 and params in memory and in the cache if set.
+        The memo and cache are shared with other projects, so the source
+        md5 is always hashed from the data rather than trusted from its id."""
+        md5 = self.md5s[1][asset[0]["assetId"]]
+        if not asset[0]["assetId"] in self.hashed[1]:
+            md5 = self.hashAsset(asset[0]["md5ext"])
+        key = (md5,) + params
+        result = self.memo.get(key)
+        if result != None:
+            return result or None # Unchanged costumes are kept as False
+
+        cacheKey = None
+        cached = None
+        if self.cache:
+            cacheKey = self.cache.key(*key)
+            cached = self.cache.get(cacheKey)
+        if cached:
+            data, info = cached
+            result = info.pop("changed") and (data, info.pop("md5"), info)
+        else:
+            try:
+                with self.sb3_file.open(asset[0]["md5ext"]) as f:
+                    result = convert(f, *params)
+            except ValueError:
+                log.warning("Failed to convert %s '%s'.", asset[0]["dataFormat"], asset[0]["name"], exc_info=True)
+                return None
+            result = result and (result[0], hashlib.md5(result[0]).hexdigest(), result[1]) or False
+            if cacheKey:
+                self.cache.put(cacheKey, result and result[0] or b"", dict(result and result[2] or {},
+                    changed=bool(result), md5=result and result[1]))
+
+        self.memo.put(key, result, result and len(result[0]) or 0)
+        return result or None
+
+    def convertSvg(self, f, *params):
+        """Returns the converted svg and where its viewBox started, or None if unchanged."""
+        result = sbsvg.convert(f, self.bufferSize)
+        return result and (result[0], {"offset": list(result[1])})
+
+    def convertBitmap(self, f, format, version, level, downscale):
+        """Returns the recompressed png and if it was halved, or None if not smaller."""
+        result = sbimage.convert(f.read(), level, downscale)
+        return result and (result[0], {"halved": result[1]})
+
+    def halveCostume(self, costume2):
+        """Changes a costume to match its downscaled bitmap."""
+        costume2["bitmapResolution"] = 1
+        for key in ["rotationCenterX", "rotationCenterY"]:
+            center = costume2[key]
+            costume2[key] = center % 2 and center / 2 or center // 2
+
+    def moveCostume(self, costume2, offset):
+        """Changes a costume to match its svg moved back by offset."""
+        costume2["rotationCenterX"] -= offset[0]
+        costume2["rotationCenterY"] -= offset[1]
+
+    def entryInfo(self, fileName2):
+        """Returns the name or ZipInfo to save a sb2 file with.
+
+        Files in storedFormats are stored, others use the zip's compression."""
+        if self.sb2_file.compression == zipfile.ZIP_STORED or \
+                not fileName2.split(".")[-1] in self.storedFormats:
+            return fileName2
+        zinfo = zipfile.ZipInfo(fileName2, time.localtime()[:6])
+        zinfo.compress_type = zipfile.ZIP_STORED
+        zinfo.external_attr = 0o600 << 16
+        return zinfo
+
+    def deflateAsset(self, asset, data):
+        """Deflates an asset whose sb2 entry is compressed, runs on a worker thread.
+
+        data is the converted asset, or None to read it from the sb3.
+        Returns the raw deflate data, crc and size of the entry for
+        writeDeflated, or data unchanged if the entry is not deflated."""
+        if self.sb2_file.compression != zipfile.ZIP_DEFLATED or \
+                asset[0]["dataFormat"] in self.storedFormats:
+            return data
+        if data == None:
+            data = self.sb3_file.read(asset[0]["md5ext"])
+        level = self.compressLevel
+        if level == None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        with self.phase("deflate"):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            return compressor.compress(data) + compressor.flush(), zlib.crc32(data), len(data)
+
+    def writeAsset(self, md5ext, fileName2, data):
+        """Saves a processed asset, copying it from the sb3 if data is None."""
+        if data == None:
+            self.copyAsset(md5ext, fileName2)
+        elif type(data) == tuple:
+            self.writeDeflated(fileName2, *data)
+        else:
+            self.sb2_file.writestr(self.entryInfo(fileName2), data)
+
+    def writeDeflated(self, fileName2, data, crc, size):
+        """Appends an entry which was already deflated by deflateAsset.
+
+        zipfile only writes data it compresses itself, so this writes the
+        header like ZipFile.open does, with the sizes and crc known."""
+        zinfo = zipfile.ZipInfo(fileName2, time.localtime()[:6])
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = size
+        zinfo.compress_size = len(data)
+        zinfo.CRC = crc
+        sb2_file = self.sb2_file
+        with sb2_file._lock:
+            if sb2_file._seekable:
+                sb2_file.fp.seek(sb2_file.start_dir)
+            zinfo.header_offset = sb2_file.fp.tell()
+            sb2_file._writecheck(zinfo)
+            sb2_file._didModify = True
+            sb2_file.fp.write(zinfo.FileHeader())
+            sb2_file.fp.write(data)
+            sb2_file.start_dir = sb2_file.fp.tell()
+            sb2_file.filelist.append(zinfo)
+            sb2_file.NameToInfo[fileName2] = zinfo
+
+    def copyAsset(self, md5ext, fileName2):
+        """Copies an asset from the sb3 to the sb2 in chunks."""
+        with self.phase("copyAsset"), self.sb3_file.open(md5ext) as src, self.sb2_file.open(self.entryInfo(fileName2), "w") as dst:
+            chunk = src.read(self.bufferSize)
+            while chunk:
+                dst.write(chunk)
+                chunk = src.read(self.bufferSize)
+
+    def phase(self, name):
+        """Returns a context which records a phase if profiling."""
+        if self.profiler:
+            return self.profiler.phase(name)
+        return _noPhase()
+
     def close(self):
         """Close all open files"""
         if self.sb3_file: self.sb3_file.close()
         if self.sb2_file: self.sb2_file.close()
 
-    # TODO Maybe just get actual sound rate?
+    def convertWave(self, data, asset):
+        """Returns the converted wav data and its md5, using the cache if set."""
+        if not self.cache:
+            with self.phase("processWave"):
+                data = self.processWave(data, asset)
+            with self.phase("md5"):
+                return data, hashlib.md5(data).hexdigest()
+
+        # Key the result by the source data and conversion parameters
+        with self.phase("md5"):
+            md5 = hashlib.md5(data).hexdigest()
+        key = self.cache.key("wav", md5, self.supportedRates, self.supportedWidths, self.quality)
+        cached = self.cache.get(key)
+        if cached:
+            data, info = cached
+            asset["rate"] = info["rate"]
+            asset["sampleCount"] = info["sampleCount"]
+            return data, info["md5"]
+
+        with self.phase("processWave"):
+            data = self.processWave(data, asset)
+        with self.phase("md5"):
+            md5 = hashlib.md5(data).hexdigest()
+        self.cache.put(key, data, {"rate": asset["rate"],
+            "sampleCount": asset["sampleCount"], "md5": md5})
+        return data, md5
+
+    def supportedFormat(self, rate, width):
+        """Returns the closest sound rate and sample width flash supports."""
+        # Find the highest supported rate TODO Is this the best way?
+        newRate = rate
+        if not rate in self.supportedRates:
+            newRate = self.supportedRates[-1]
+            for r in self.supportedRates:
+                if rate > r:
+                    newRate = r
+                    break
+        newWidth = width
+        if not width in self.supportedWidths:
+            newWidth = self.supportedWidths[-1]
+        return newRate, newWidth
+
     def processWave(self, data, asset):
+        """Returns the wav data converted to a format flash supports."""
         if asset["format"] == "adpcm":
             log.warning("Sound rate verification for adpcm wav '%s' not supported." % asset["soundName"])
             return data
 
         # Read the sound with wave
-        data = io.BytesIO(data)
-        wav = wave.open(data, "rb")
+        import wave
+        wav = wave.open(io.BytesIO(data), "rb")
 
         # Get info about the sound
         channels = wav.getnchannels()
         width = wav.getsampwidth()
         rate = wav.getframerate() # TODO These don't match json?
         sampleCount = wav.getnframes()
+        newRate, newWidth = self.supportedFormat(rate, width)
 
-        # Resample and monofy the sound
-        changed = False
-        sound = wav.readframes(sampleCount)
-        if channels > 1:
-            log.debug("Monofying sound '%s'" %asset["md5"])
-            sound = audioop.tomono(sound, width, 1, 1)
-            changed = True
-        if not rate in self.supportedRates:
-            log.debug("Resamping sound '%s'" %asset["md5"])
-            # Find the highest supported rate TODO Is this the best way?
-            newRate = self.supportedRates[-1]
-            for r in self.supportedRates:
-                if rate > r:
-                    newRate = r
-                    break
-
-            # Resample the sound
-            sound = audioop.ratecv(sound, width, 1, rate, newRate, None)[0]
+        if channels > 1 or newRate != rate or newWidth != width:
+            # Monofy, resample and change the sample width of the sound
+            log.debug("Converting sound '%s' from %i channels at %iHz" % (asset["md5"], channels, rate))
+            sound = wav.readframes(sampleCount)
+            sound = sbaudio.convert(sound, channels, width, rate, newRate, newWidth, self.quality)
             rate = newRate
-            changed = True
-        
-        if changed:
+            sampleCount = len(sound) // newWidth
+
             # Get the wav data
-            data = io.BytesIO()
-            wav = wave.open(data, "wb")
+            output = io.BytesIO()
+            wav = wave.open(output, "wb")
             wav.setnchannels(1)
-            wav.setframerate(rate)
-            wav.setsampwidth(width)
+            wav.setframerate(newRate)
+            wav.setsampwidth(newWidth)
             wav.writeframes(sound)
+            data = output.getvalue()
 
         # Save framerate and sampleCount
-        data.seek(0)
-        wav = wave.open(data, "rb")
-        asset["rate"] = wav.getframerate()
-        asset["sampleCount"] = wav.getnframes()
+        asset["rate"] = rate
+        asset["sampleCount"] = sampleCount
+
+        return data
+
+class AssetCache:
+    """A folder of converted assets which evicts the least recently used."""
+
+    version = 1 # Change when converted assets are no longer valid
+    checkEvery = 256 # Puts between counting the whole folder, other processes may add to it
+    lowWater = 0.9 # Evict down to this fraction of maxSize so eviction is rare
+
+    def __init__(self, path, maxSize=256 * 1024 * 1024):
+        """Opens or creates the cache folder, maxSize is in bytes."""
+        self.path = path
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.size = None # Estimated bytes in the folder, counted by evict
+        self.puts = 0 # Puts since the folder was counted
+        self.lock = threading.Lock() # Guards the counts, assets are cached from worker threads
+
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, *params):
+        """Returns a cache key for the given source md5 and parameters."""
+        params = json.dumps([self.version, params])
+        return hashlib.md5(params.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the data and info saved with a key or None."""
+        path = os.path.join(self.path, key)
+        try:
+            with open(path, "rb") as f:
+                info = json.loads(f.readline())
+                data = f.read()
+            os.utime(path) # Mark as recently used
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data, info
+
+    def put(self, key, data, info):
+        """Saves data and a json serializable info dict with a key."""
+        import tempfile
+        path = os.path.join(self.path, key)
+        info = json.dumps(info).encode("utf-8") + b"\n"
+        temp = None
+        try:
+            # Each thread writes its own temp file, the same key may be put twice at once
+            fd, temp = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+            with os.fdopen(fd, "wb") as f:
+                f.write(info)
+                f.write(data)
+            os.replace(temp, path)
+        except OSError:
+            log.warning("Failed to save '%s' to the asset cache.", key, exc_info=True)
+            if temp:
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass # Already replaced or never written
+            return
+
+        # Only count the whole folder now and then
+        with self.lock:
+            self.puts += 1
+            if self.size == None or self.puts >= self.checkEvery:
+                self.evict()
+            else:
+                self.size += len(info) + len(data)
+                if self.size > self.maxSize:
+                    self.evict()
+
+    def evict(self):
+        """Counts the folder and removes the least recently used entries
+        until under lowWater if it is over maxSize. Called with the lock held."""
+        entries = []
+        size = 0
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+
+        if size > self.maxSize:
+            entries.sort()
+            for mtime, entrySize, path in entries:
+                if size <= self.maxSize * self.lowWater:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass # Removed by another process
+                size -= entrySize
+        self.size = size
+        self.puts = 0
+
+class Memo:
+    """A thread safe dict of recent results which forgets the oldest past a size."""
+
+    def __init__(self, maxSize):
+        """maxSize -- the most bytes of results to keep"""
+        self.maxSize = maxSize
+        self.size = 0
+        self.items = {} # Results and their sizes, oldest first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the result saved with a key or None."""
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item == None:
+                return None
+            self.items[key] = item # Mark as recently used
+            return item[0]
+
+    def put(self, key, result, size=0):
+        """Saves a result which is not None with a key."""
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (result, size)
+            self.size += size
+            while self.size > self.maxSize or len(self.items) > 4096:
+                self.size -= self.items.pop(next(iter(self.items)))[1]
+
+SbFiles.memo = Memo(32 * 1024 * 1024)
+
+class Profiler:
+    """Records the wall time and memory used by each phase of a conversion.
+
+    Phases may be nested and may run on worker threads, but only phases
+    on the thread which started the profiler record memory."""
+
+    def __init__(self, memory=True, cprofile=False):
+        """memory -- trace the peak memory of each phase with tracemalloc
+        cprofile -- also run cProfile and report the slowest functions"""
+        self.memory = memory
+        self.cprofile = cprofile
+        self.phases = {} # Totals by phase name
+        self.targets = [] # Totals for each parsed target
+        self.elapsed = 0
+        self.lock = threading.Lock()
+        self.thread = threading.get_ident()
+        self.stack = [] # The running phases which record memory
+        self.started = None
+        self.tracing = False # True if tracemalloc was started by the profiler
+        self.profile = None
+
+    def start(self):
+        """Starts timing the conversion."""
+        import tracemalloc
+        self.thread = threading.get_ident()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        if self.cprofile:
+            import cProfile
+            self.profile = self.profile or cProfile.Profile()
+            self.profile.enable()
+        self.started = time.perf_counter()
+
+    def stop(self):
+        """Stops timing the conversion."""
+        if self.started != None:
+            self.elapsed += time.perf_counter() - self.started
+            self.started = None
+        if self.profile:
+            self.profile.disable()
+        if self.tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self.tracing = False
+
+    @contextlib.contextmanager
+    def phase(self, name, target=None):
+        """Records the time and memory of the code run inside the context.
+
+        If target is set the phase is also recorded for that target."""
+        import tracemalloc
+        main = threading.get_ident() == self.thread
+        if main:
+            # Start recording memory used by this phase
+            frame = {"blocks": sys.getallocatedblocks(), "start": 0, "peak": 0}
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                if self.stack:
+                    self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+                tracemalloc.reset_peak()
+                frame["start"] = frame["peak"] = current
+            self.stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {"time": time.perf_counter() - start}
+            if main:
+                self.stack.pop()
+                record["allocated"] = sys.getallocatedblocks() - frame["blocks"]
+                if tracemalloc.is_tracing():
+                    peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+                    record["peak"] = peak - frame["start"]
+                    if self.stack:
+                        self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+            self.record(name, record, target)
+
+    def record(self, name, record, target=None):
+        """Adds a finished phase to the totals."""
+        with self.lock:
+            if not name in self.phases:
+                self.phases[name] = {"calls": 0, "time": 0}
+            total = self.phases[name]
+            total["calls"] += 1
+            total["time"] += record["time"]
+            if "allocated" in record:
+                total["allocated"] = total.get("allocated", 0) + record["allocated"]
+            if "peak" in record:
+                total["peak"] = max(total.get("peak", 0), record["peak"])
+            if target != None:
+                self.targets.append(dict(record, name=target))
+
+    def report(self, top=30):
+        """Returns the results as a json serializable dict.
+
+        Times are in seconds and are summed over threads, allocated is the
+        change in the number of allocated memory blocks and peak is the
+        most bytes used at once."""
+        report = {"elapsed": self.elapsed, "phases": self.phases, "targets": self.targets}
+        if self.profile:
+            # Add the functions with the most cumulative time
+            import pstats
+            stats = pstats.Stats(self.profile).stats
+            functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            report["functions"] = [{"function": "%s:%i(%s)" % function, "calls": s[1],
+                "time": s[2], "cumulative": s[3]} for function, s in functions]
+        return report
+
+    def save(self, path):
+        """Saves the report to a json file."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+def _noPhase(name=None, target=None):
+    """Used in place of Profiler.phase when not profiling."""
+    return contextlib.nullcontext()
+
+class JsonReader:
+    """Parses json values one at a time from a binary file object.
+
+    Text is read in chunks and dropped once it is parsed, so only about
+    as much text as the largest value is held in memory."""
+
+    whitespace = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, stream, bufferSize=64 * 1024):
+        self.stream = stream
+        self.text = "" # Text which is not parsed yet, from index
+        self.index = 0
+        self.start = 0 # Where the last decoded value starts in text
+        self.largest = 0 # Length of the largest value decoded so far
+        self.bufferSize = bufferSize
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.done = False # The stream has been read to its end
+
+    def more(self, size=0):
+        """Reads at least size more bytes, dropping the parsed text.
+
+        Returns False if the stream has ended."""
+        if self.done:
+            return False
+        data = self.stream.read(max(size, self.bufferSize))
+        self.done = not data
+        try:
+            chunk = self.utf8.decode(data, self.done)
+        except UnicodeDecodeError as e:
+            raise json.decoder.JSONDecodeError("Invalid utf-8: %s" % e, self.text, len(self.text))
+        self.text = self.text[self.index:] + chunk
+        self.index = 0
+        return not self.done
+
+    def peek(self):
+        """Skips whitespace and returns the next char, or "" at the end."""
+        self.index = self.whitespace.match(self.text, self.index).end()
+        while self.index == len(self.text) and self.more():
+            self.index = self.whitespace.match(self.text, self.index).end()
+        return self.text[self.index:self.index + 1]
+
+    def skip(self, char, end=None):
+        """Skips whitespace and a separator char.
+
+        The separator is optional if the end char follows instead."""
+        found = self.peek()
+        if found == char:
+            self.index += 1
+        elif found != end:
+            raise json.decoder.JSONDecodeError("Expecting '%s' delimiter" % char, self.text, self.index)
+
+    def decode(self):
+        """Returns the next json value, reading until it is complete.
+
+        Its json is text[start:index] until more is read."""
+        self.peek()
+
+        # Values such as targets are often alike, so read as much as the largest
+        # first. Parsing a value which is not all read yet is wasted.
+        available = len(self.text) - self.index
+        if available < self.largest:
+            self.more(self.largest + self.largest // 4 - available)
+        while True:
+            try:
+                self.start = self.index
+                value, end = self.decoder.raw_decode(self.text, self.index)
+                # A number at the end of the text may go on in the next chunk
+                if end < len(self.text) or self.done:
+                    self.index = end
+                    self.largest = max(self.largest, end - self.start)
+                    return value
+            except json.decoder.JSONDecodeError:
+                if self.done:
+                    raise
+            # Double the text each time so long values are not parsed many times
+            self.more(len(self.text) - self.index)
 
-        data.seek(0)
-        return data.read()
+    def close(self):
+        self.stream.close()
+
+class MappedFile(io.RawIOBase):
+    """Reads an mmap as a seekable file without copying it.
+
+    Before Python 3.13 mmap has no seekable method, which zipfile needs."""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.mapped[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += len(self.mapped)
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def __len__(self):
+        return len(self.mapped)
+
+class AsyncConverter:
+    """Converts projects from asyncio code without blocking the event loop.
+
+    Reading, converting, resampling, hashing and saving run in a thread
+    executor. Conversions are not picklable, so a process pool can not
+    be used, but the worker threads give up the GIL often enough for the
+    event loop to stay responsive. Project json is streamed by default so
+    json parsing only holds the GIL for one target at a time."""
+
+    def __init__(self, limit=None, executor=None):
+        """Sets how many conversions may run at once and where they run.
+
+        limit -- defaults to the cpu count, others wait for a turn
+        executor -- a thread executor, defaults to the loop's executor"""
+        self.limit = limit or os.cpu_count() or 1
+        self.executor = executor
+        import asyncio
+        self.semaphore = asyncio.Semaphore(self.limit)
+
+    async def convert(self, sb3, sb2=None, overwrite=False, optimize=False, progress=None, cache=None, specmap_path="", **options):
+        """Converts a sb3 and returns the sb2 bytes, or None if it failed.
+
+        sb3 -- the sb3 path, bytes or a readable and seekable file object
+        sb2 -- a path or file object to save to instead, then True is returned
+        overwrite -- allow overwriting an existing sb2 path
+        optimize -- try to convert strings to numbers
+        progress -- called on the event loop with the kind and name of each
+            converted "target" and processed "sound" or "costume"
+        cache -- an AssetCache or folder path for reusing converted assets
+        specmap_path -- change the load path for the sb3 to sb2 specmap
+        options -- other keyword arguments for SbFiles, such as quality
+
+        Cancelling the task stops the conversion at the next target or
+        asset and closes the files before the cancellation is raised."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+        def report(kind, name):
+            # Runs on the worker thread
+            if cancelled.is_set():
+                raise futures.CancelledError()
+            if progress:
+                loop.call_soon_threadsafe(progress, kind, name)
+
+        if type(cache) == str:
+            cache = AssetCache(cache)
+        options.setdefault("stream", True)
+        output = sb2 or io.BytesIO()
+        async with self.semaphore:
+            sbf = None
+            try:
+                sbf = await self.run(cancelled, SbFiles, sb3, output, overwrite, cache=cache, **options)
+                success = sbf.sb3_file and sbf.sb2_file and await self.convertFiles(cancelled, sbf, optimize, cache, report, specmap_path)
+            finally:
+                if sbf:
+                    await self.run(cancelled, sbf.close)
+
+        if sb2 != None:
+            return bool(success)
+        elif success:
+            return output.getvalue()
+        return None
+
+    async def convertFiles(self, cancelled, sbf, optimize, cache, report, specmap_path=""):
+        """Converts the json of opened files and saves the sb2."""
+        sb3 = await self.run(cancelled, sbf.getSb3)
+        if not sb3:
+            log.critical("Failed to load sb3 json.")
+            return False
+        converter = Converter(None, loadSpecmap(specmap_path))
+        converter.numberOpt = optimize
+        converter.spaceOpt = optimize
+        converter.store = cache
+        converter.progress = sbf.progress = report
 
-class Converter:
-    """Class for converting a sb3 project json to the sb2 format"""
+        try:
+            if sbf.json_path == "project.json":
+                converter.reset(sb3)
+                sb2, filemap = await self.run(cancelled, converter.convert)
+            else:
+                sb2 = await self.run(cancelled, converter.convertTarget, sb3)
+                filemap = converter.filemap
+        except json.decoder.JSONDecodeError:
+            # Streamed targets are only parsed while converting
+            log.warning("File '%s/%s' is not a valid json file.", sbf.sb3_name, sbf.json_path)
+            log.critical("Failed to load sb3 project json.")
+            return False
+        return await self.run(cancelled, sbf.saveSb2, sb2, filemap)
+
+    async def run(self, cancelled, func, *args, **kwargs):
+        """Runs func in the executor.
 
-    sb3 = {} # The sb3 project json
-    sb2 = {} # The sb2 project json
+        If the task is cancelled, func is stopped at its next progress
+        report and waited for so its files are not closed while in use."""
+        import asyncio
+        future = asyncio.get_running_loop().run_in_executor(self.executor,
+            lambda: func(*args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            await asyncio.wait([future])
+            if not future.cancelled():
+                future.exception() # The stop is expected, do not log it
+            raise
 
-    specmap2 = {} # A specmap for sb3 to sb2
-    filemap = [{}, {}] # List of sb3 files and their sb2 names
+class Converter:
+    """Class for converting a sb3 project json to the sb2 format"""
 
-    sprites = [] # Holds the children of the stage
-    blockIds = [] # Temporarily holds blockIds for anchoring comments
+    # Conversion state, set for each instance by reset
+    sb3 = None # The sb3 project json
+    sb2 = None # The sb2 project json
+
+    specmap2 = None # A specmap for sb3 to sb2
+    filemap = None # List of sb3 files and their sb2 names
+
+    sprites = None # Holds the children of the stage
+    lists = None # Holds list ids and sb2 lists for positioning with monitors
+    monitors = None # Holds sb2 monitors by their sb3 ids
+    blockIds = None # Temporarily maps blockIds to sb2 block indexes for comments
+    blockCount = 0 # The number of sb2 blocks indexed in the current target
+    prototypes = None # Parsed custom block prototypes of the current target by proccode, for calls
+    definitions = None # Parsed custom block prototypes of the current target by block id
+    profiler = None # Records the time and memory of each target if set
+    progress = None # Called with the kind and name of each converted target if set
+    stats = None # Counts of the targets, blocks and comments converted
+    store = None # An AssetCache for reusing targets which have not changed
+    specmapFingerprint = None # The md5 of the specmap in stored target keys, set when first needed
+    targetVersion = 1 # Change when stored targets are no longer valid
 
     # TODO Make space adjustable based on version made in
     spaceX = 1.5 # Size adjustment factor
@@ -379,26 +1531,87 @@ class Converter:
 
     def __init__(self, project, specmap2):
         """Sets the sb3 project and specmap for the convertor."""
-        self.sb3 = project
         self.specmap2 = specmap2
+        self.reset(project)
+
+        # Get the handlers for each opcode, the specmap is only compiled once
+        self.blockHandlers = dict(compileSpecmap(specmap2, self.staticFields))
+        self.blockHandlers.update({
+            "procedures_definition": self.parseProcDef,
+            "procedures_call": self.parseCall,
+            "argument_reporter_string_number": self.parseStringParam,
+            "argument_reporter_boolean": self.parseBooleanParam,
+            "looks_gotofrontback": self.parseFrontBack,
+            "looks_goforwardbackwardlayers": self.parseForwardBackward,
+            "looks_costumenumbername": self.parseCostumeNumberName,
+            "looks_backdropnumbername": self.parseBackdropNumberName,
+            "data_deletealloflist": self.parseDeleteAll
+        })
+
+        # Get the handlers for each input type
+        self.inputHandlers = {
+            4: self.parseNumber, # Float
+            5: self.parseNumber, # UFloat
+            6: self.parseNumber, # UInteger
+            7: self.parseNumber, # Integer
+            8: self.parseNumber, # Float angle
+            9: self.parseColor,
+            10: self.parseText, # String
+            11: self.parseText, # Broadcast
+            12: self.parseVariable,
+            13: self.parseList
+        }
+
+    def reset(self, project=None):
+        """Clears the results of the last conversion and sets a new project.
+
+        Lets one converter be reused for many projects. Results returned
+        earlier are not changed."""
+        self.sb3 = project
+        self.sb2 = {}
+        self.filemap = [{}, {}]
+        self.sprites = []
+        self.lists = []
+        self.monitors = {}
+        self.blockIds = {}
+        self.blockCount = 0
+        self.prototypes = {}
+        self.definitions = {}
+        self.stats = {"targets": 0, "blocks": 0, "comments": 0, "unknownOpcodes": {}}
     
     def convert(self):
         """Convert the loaded sb3 project to sb2 format"""
-        # Parse all monitors which go with sprites
-        self.monitors = {}
-        for monitor in self.sb3["monitors"]:
-            monitor2 = self.parseMonitor(monitor)
-            if monitor2:
-                self.monitors[monitor["id"]] = monitor2
-
-        # Parse each target(sprite)
+        # Parse each target(sprite), targets may be parsed as they are reached
+        self.lists = []
         sprites = {}
         for target in self.sb3["targets"]:
-            object = self.parseTarget(target)
+            with self.phase("parseTarget", target.get("name")):
+                object = self.convertTarget(target)
+            if self.progress:
+                self.progress("target", target.get("name"))
             if "isStage" in target and target["isStage"]:
                 self.sb2 = object
             else:
                 sprites[target["layerOrder"]] = object
+            target = object = None # Free the sb3 target before parsing the next
+
+        # Parse all monitors which go with sprites
+        self.monitors = {}
+        with self.phase("monitors"):
+            for monitor in self.sb3["monitors"]:
+                monitor2 = self.parseMonitor(monitor)
+                if monitor2:
+                    self.monitors[monitor["id"]] = monitor2
+
+        # Position lists with their monitors
+        for l, list2 in self.lists:
+            if l in self.monitors:
+                monitor = self.monitors[l]
+                list2["x"] = monitor["x"] or 5
+                list2["y"] = monitor["y"] or 5
+                list2["width"] = monitor["width"] or 104
+                list2["height"] = monitor["height"] or 204
+                list2["visible"] = monitor["visible"] or False
         
         # Order the sprites correctly
         for l in sorted(sprites):
@@ -458,31 +1671,30 @@ class Converter:
         for l in target["lists"]:
             lst = target["lists"][l]
 
-            # Get the monitor related to this list
-            if l in self.monitors:
-                monitor = self.monitors[l]
-            else:
-                monitor = None
-
             # Convert special values and possibly optimize all numbers
             for i in range(0, len(lst[1])):
                 lst[1][i] = self.specialNumber(lst[1][i], self.numberOpt)
 
-            lists.append({
+            # Monitor positions are added once all monitors are parsed
+            list2 = {
                 "listName": lst[0],
                 "contents": lst[1],
                 "isPersistent": False,
-                "x": monitor and monitor["x"] or 5,
-                "y": monitor and monitor["y"] or 5,
-                "width": monitor and monitor["width"] or 104,
-                "height": monitor and monitor["height"] or 204,
-                "visible": monitor and monitor["visible"] or False
-            })
+                "x": 5,
+                "y": 5,
+                "width": 104,
+                "height": 204,
+                "visible": False
+            }
+            lists.append(list2)
+            self.lists.append((l, list2))
         if lists:
             sprite["lists"] = lists
 
         # Get scripts
-        self.blockIds = [] # Holds blocks for comment anchoring
+        self.blockIds = {} # Holds blocks for comment anchoring
+        self.blockCount = 0
+        self.indexPrototypes(target["blocks"])
         scripts = []
         for b in target["blocks"]:
             block = target["blocks"][b]
@@ -504,19 +1716,18 @@ class Converter:
                     script[2].append(["contentsOfList:", block[1]])
                 
                 scripts.append(script)
-                self.blockIds.append(b)
+                self.indexBlock(b)
                 
         if scripts:
             sprite["scripts"] = scripts
+        self.stats["targets"] += 1
+        self.stats["blocks"] += self.blockCount
 
         # Get script comments
         comments = []
         for c in target["comments"]:
             comment = target["comments"][c]
-            if comment["blockId"] in self.blockIds:
-                blockIndex = self.blockIds.index(comment["blockId"])
-            else:
-                blockIndex = -1
+            blockIndex = self.blockIds.get(comment["blockId"], -1)
             if comment["x"] == None:
                 comment["x"] = 0
             if comment["y"] == None:
@@ -532,44 +1743,12 @@ class Converter:
             ])
         if comments:
             sprite["scriptComments"] = comments
+        self.stats["comments"] += len(comments)
 
-        # Get sounds
-        sounds = []
-        for sound in target["sounds"]:
-            if sound["assetId"] in self.filemap[0]:
-                sound2 = self.filemap[0][sound["assetId"]][1]
-            else:
-                sound2 = {
-                    "soundName": sound["name"],
-                    "soundID": len(self.filemap[0]),
-                    "md5": sound["md5ext"],
-                    "sampleCount": sound["sampleCount"],
-                    "rate": sound["rate"],
-                    "format": "format" in sound and sound["format"] or ""
-                }
-                self.filemap[0][sound["assetId"]] = [sound, sound2]
-            sounds.append(sound2)
+        # Get sounds and costumes
+        sounds, costumes = self.parseAssets(target)
         if sounds:
             sprite["sounds"] = sounds
-
-        # Get costumes
-        costumes = []
-        for costume in target["costumes"]:
-            if costume["assetId"] in self.filemap[1]:
-                costume2 = self.filemap[1][costume["assetId"]][1]
-            else:
-                costume2 = {
-                    "costumeName": costume["name"],
-                    "baseLayerID": len(self.filemap[1]),
-                    "baseLayerMD5": costume["md5ext"],
-                }
-                if "bitmapResolution" in costume:
-                    costume2["bitmapResolution"] = costume["bitmapResolution"]
-                costume2["rotationCenterX"] = costume["rotationCenterX"]
-                costume2["rotationCenterY"] = costume["rotationCenterY"]
-                
-                self.filemap[1][costume["assetId"]] = [costume, costume2]
-            costumes.append(costume2)
         sprite["costumes"] = costumes
 
         # Get other attributes
@@ -610,8 +1789,8 @@ class Converter:
         # Holds the list which parsed blocks are added to
         chain = []
         
-        # Initialize the queue
-        self.queue = [[id, chain, True]]
+        # Initialize the queue, inputs are parsed before the next block
+        self.queue = deque([[id, chain, True]])
 
         # Get the position of the script
         script.append(round(blocks[id]["x"] / self.spaceX))
@@ -622,7 +1801,7 @@ class Converter:
 
         while self.queue:
             # Get the next block to be parsed
-            next = self.queue.pop(0)
+            next = self.queue.popleft()
             blockId = next[0]
             if next[2]:
                 # It's a stack
@@ -635,7 +1814,7 @@ class Converter:
 
 
             # Save the id for comment anchoring
-            self.blockIds.append(blockId)
+            self.indexBlock(blockId)
 
             # Get the sb3 block
             block3 = blocks[blockId]
@@ -643,115 +1822,41 @@ class Converter:
             # Get the 3.0 opcode
             opcode = block3["opcode"]
 
-            # Get the specmap for the block, handle custom blocks
-            argmap = None
-            if opcode == "procedures_definition":
-                # Handle custom block definition
-                value = block3["inputs"]["custom_block"][1]
-                value = blocks[value]["mutation"]
-                current.append("procDef")
-                current.append(value["proccode"])
-                current.append(json.loads(value["argumentnames"]))
-                current.append(json.loads(value["argumentdefaults"]))
-                if value["warp"] == "true" or value["warp"] == True:
-                    current.append(True)
-                elif value["warp"] == "false" or value["warp"] == False:
-                    current.append(False)
-            elif opcode == "procedures_call":
-                # Handle custom block call
-                value = block3["mutation"]
-                current.append("call")
-                current.append(value["proccode"])
-
-                # Create a custom argument map
-                argmap = []
-                for arg in json.loads(value["argumentids"]):
-                    argmap.append(["input",arg])
-            elif opcode == "argument_reporter_string_number":
-                # Handle custom block string/number reporter
-                current.append("getParam")
-                current.append(block3["fields"]["VALUE"][0])
-                current.append("r")
-            elif opcode == "argument_reporter_boolean":
-                # Handle custom block boolean reporter
-                current.append("getParam")
-                current.append(block3["fields"]["VALUE"][0])
-                current.append("b")
-            # Handle some sb3 exclusive workarounds
-            elif opcode == "looks_gotofrontback":
-                # Handle the new front/back argument
-                if block3["fields"]["FRONT_BACK"][0] == "back":
-                    current.append("goBackByLayers:")
-                    current.append(999)
-                else:
-                    current.append("comeToFront")
-            elif opcode == "looks_goforwardbackwardlayers":
-                # Handle the new fowards/back argument
-                current.append("goBackByLayers:")
-                try:
-                    if block3["fields"]["FORWARD_BACKWARD"][0] == "foward":
-                        current.append(int(block3["inputs"]["NUM"][1][1]) * -1)
-                    else:
-                        current.append(block3["inputs"]["NUM"][1][1])
-                except:
-                    current.append(block3["inputs"]["NUM"][1][1])
-            elif opcode == "looks_costumenumbername":
-                if block3["fields"]["NUMBER_NAME"][0] == "name":
-                    current.append("costumeName") # Undefined block
-                else:
-                    current.append("costumeIndex")
-            elif opcode == "looks_backdropnumbername":
-                if block3["fields"]["NUMBER_NAME"][0] == "number":
-                    current.append("backgroundIndex")
-                else:
-                    current.append("sceneName")
-            elif opcode == "data_deletealloflist":
-                current.append("deleteLine:ofList:")
-                current.append("all")
-                current.append(block3["fields"]["LIST"][0])
-            elif opcode in self.specmap2:
-                # Get the sb2 block id
-                current.append(self.specmap2[opcode][0])
-
-                # Get the block's argmap
-                argmap = self.specmap2[opcode][1]
+            # Add the sb2 block id and get the block's argmap
+            handler = self.blockHandlers.get(opcode)
+            if handler:
+                argmap = handler(block3, blocks, current)
             else:
-                # It's probably a Scratch 3 block that this can't convert
-                current.append(opcode)
-
-                # Make a custom argmap for it
-                argmap = []
-                for field in block3["fields"]:
-                    argmap.append(["field",field])
-                for input in block3["inputs"]:
-                    argmap.append(["input",input])
+                argmap = self.parseUnknown(block3, blocks, current)
 
             if argmap != None:
-                # Arguments in the queue counter
-                self.q = 0
+                # Holds input blocks to be parsed next
+                self.inputs = []
 
                 # Parse each parameter
-                for arg in argmap:
-                    if arg[0] == "field":
+                for isField, name, lower in argmap:
+                    if isField:
                         # Get the sb3 field argument
-                        value = block3["fields"][arg[1]][0]
+                        value = block3["fields"][name][0]
 
                         # Some fields are all caps for some reason
-                        if opcode in self.staticFields:
+                        if lower:
                             value = value.lower()
-                    elif arg[0] == "input":
-                        if arg[1] in block3["inputs"]:
-                            try:
-                                # Get the sb3 input argument
-                                value = self.parseInput(block3, arg[1], blocks)
-                            except:
-                                log.error("Unkown error parsing arguments.", exc_info=True)
-                                value = block3["inputs"][arg[1]]
-                        else:
-                            value = None # Empty substacks not always stored?
+                    elif name in block3["inputs"]:
+                        try:
+                            # Get the sb3 input argument
+                            value = self.parseInput(block3, name, blocks)
+                        except:
+                            log.error("Unkown error parsing arguments.", exc_info=True)
+                            value = block3["inputs"][name]
+                    else:
+                        value = None # Empty substacks not always stored?
 
                     # Add the parsed parameter to the block
                     current.append(value)
+
+                # Queue the input blocks in order before anything else
+                self.queue.extendleft(reversed(self.inputs))
             
             # Add the block to the script
             if chain != False:
@@ -763,7 +1868,146 @@ class Converter:
         
         return script
 
+    def phase(self, name, target=None):
+        """Returns a context which records a phase if profiling."""
+        if self.profiler:
+            return self.profiler.phase(name, target)
+        return _noPhase()
+
+    def indexPrototypes(self, blocks):
+        """Parses the custom block prototypes of a target by block id.
+
+        Calls use the first prototype found with their proccode."""
+        self.prototypes = {}
+        self.definitions = {}
+        for id in blocks:
+            block = blocks[id]
+            if type(block) == dict and block["opcode"] == "procedures_prototype":
+                mutation = block["mutation"]
+                prototype = self.definitions[id] = self.parsePrototype(mutation)
+                if not mutation["proccode"] in self.prototypes:
+                    self.prototypes[mutation["proccode"]] = prototype
+
+    def parsePrototype(self, mutation):
+        """Parses a custom block mutation.
+
+        Returns a dict with the argument ids, names, defaults and warp. Call
+        mutations only have ids, so the other values are None."""
+        prototype = {"names": None, "defaults": None, "warp": None}
+        prototype["ids"] = json.loads(mutation["argumentids"])
+        if "argumentnames" in mutation:
+            prototype["names"] = json.loads(mutation["argumentnames"])
+            prototype["defaults"] = json.loads(mutation["argumentdefaults"])
+        if "warp" in mutation:
+            if mutation["warp"] == "true" or mutation["warp"] == True:
+                prototype["warp"] = True
+            elif mutation["warp"] == "false" or mutation["warp"] == False:
+                prototype["warp"] = False
+
+        # Create a custom argument map for calls
+        prototype["argmap"] = tuple((False, arg, False) for arg in prototype["ids"])
+        return prototype
+
+    def parseProcDef(self, block3, blocks, current):
+        """Handles custom block definitions."""
+        id = block3["inputs"]["custom_block"][1]
+        value = blocks[id]["mutation"]
+        prototype = self.definitions.get(id)
+        if not prototype or prototype["names"] == None:
+            prototype = self.parsePrototype(value)
+        current.append("procDef")
+        current.append(value["proccode"])
+        current.append(prototype["names"])
+        current.append(prototype["defaults"])
+        if prototype["warp"] != None:
+            current.append(prototype["warp"])
+
+    def parseCall(self, block3, blocks, current):
+        """Handles custom block calls, returns an argmap of their inputs."""
+        value = block3["mutation"]
+        current.append("call")
+        current.append(value["proccode"])
+
+        # Calls without a prototype in the target are parsed once
+        prototype = self.prototypes.get(value["proccode"])
+        if not prototype:
+            prototype = self.parsePrototype(value)
+            self.prototypes[value["proccode"]] = prototype
+        return prototype["argmap"]
+
+    def parseStringParam(self, block3, blocks, current):
+        """Handles custom block string/number reporters."""
+        current.append("getParam")
+        current.append(block3["fields"]["VALUE"][0])
+        current.append("r")
+
+    def parseBooleanParam(self, block3, blocks, current):
+        """Handles custom block boolean reporters."""
+        current.append("getParam")
+        current.append(block3["fields"]["VALUE"][0])
+        current.append("b")
+
+    # Handle some sb3 exclusive workarounds
+    def parseFrontBack(self, block3, blocks, current):
+        """Handles the new front/back argument."""
+        if block3["fields"]["FRONT_BACK"][0] == "back":
+            current.append("goBackByLayers:")
+            current.append(999)
+        else:
+            current.append("comeToFront")
+
+    def parseForwardBackward(self, block3, blocks, current):
+        """Handles the new fowards/back argument."""
+        current.append("goBackByLayers:")
+        try:
+            if block3["fields"]["FORWARD_BACKWARD"][0] == "foward":
+                current.append(int(block3["inputs"]["NUM"][1][1]) * -1)
+            else:
+                current.append(block3["inputs"]["NUM"][1][1])
+        except:
+            current.append(block3["inputs"]["NUM"][1][1])
+
+    def parseCostumeNumberName(self, block3, blocks, current):
+        if block3["fields"]["NUMBER_NAME"][0] == "name":
+            current.append("costumeName") # Undefined block
+        else:
+            current.append("costumeIndex")
+
+    def parseBackdropNumberName(self, block3, blocks, current):
+        if block3["fields"]["NUMBER_NAME"][0] == "number":
+            current.append("backgroundIndex")
+        else:
+            current.append("sceneName")
+
+    def parseDeleteAll(self, block3, blocks, current):
+        current.append("deleteLine:ofList:")
+        current.append("all")
+        current.append(block3["fields"]["LIST"][0])
+
+    def parseUnknown(self, block3, blocks, current):
+        """Passes through a block which isn't in the specmap."""
+        # It's probably a Scratch 3 block that this can't convert
+        current.append(block3["opcode"])
+        unknown = self.stats["unknownOpcodes"]
+        unknown[block3["opcode"]] = unknown.get(block3["opcode"], 0) + 1
+
+        # Make a custom argmap for it
+        argmap = []
+        for field in block3["fields"]:
+            argmap.append((True, field, False))
+        for input in block3["inputs"]:
+            argmap.append((False, input, False))
+        return argmap
+
+    def indexBlock(self, blockId):
+        """Saves the sb2 index of a block for anchoring comments."""
+        # Comments anchor to the first block with the id
+        if not blockId in self.blockIds:
+            self.blockIds[blockId] = self.blockCount
+        self.blockCount += 1
+
     def parseInput(self, block, inp, blocks):
+        """Converts a sb3 input to a sb2 argument."""
         # Get the input from the block
         value = block["inputs"][inp]
 
@@ -777,68 +2021,59 @@ class Converter:
             value = [2, value[1]]
         if value[0] == 2: # Block
             value = value[1]
-
             if type(value) != list: # Make sure it's not a variable
-                if value in blocks:
-                    id = value
-                    if blocks[id]["shadow"] and inp in blocks[id]["fields"]:
-                        # It's probably be a menu
-                        value = blocks[id]["fields"][inp][0]
-                    elif inp in ["SUBSTACK", "SUBSTACK2"]:
-                        value = []
-                        self.queue.insert(self.q, [id, value, True])
-                        self.q += 1
-                    else:
-                        value = []
-                        self.queue.insert(self.q, [id, value, False])
-                        self.q += 1
-                elif value == None:
-                    # Blank value in bool input is null in sb3 but false in sb2
-                    if not inp in ["SUBSTACK", "SUBSTACK2"]:
-                        value = False
-                else:
-                    log.warning("Invalid block id: 's'" %value)
+                return self.parseBlockInput(value, inp, blocks)
 
-                return value
+        # Handle values by their type
+        parse = self.inputHandlers.get(value[0])
+        if parse:
+            return parse(value)
+        log.warning("Invalid value type: '%s'" %value[1])
+        return value
 
-        # Handle number values
-        if value[0] == 4: # Float value
-            value = value[1]
-        elif value[0] == 5: # UFloat value
-            value = value[1]
-        elif value[0] == 6: # UInteger value
-            value = value[1]
-        elif value[0] == 7: # Integer value
-            value = value[1]
-        elif value[0] == 8: # Float angle value
-            value = value[1]
-        elif value[0] == 9: # Hex color value
-            try:
-                value = int(value[1].strip("#"), 16)
-            except ValueError:
-                log.warning("Unable to convert hex: '%s'" %value[1])
-                value = value[1]
+    def parseBlockInput(self, id, inp, blocks):
+        """Converts a block in an input, queueing it to be parsed."""
+        if id in blocks:
+            if blocks[id]["shadow"] and inp in blocks[id]["fields"]:
+                # It's probably be a menu
+                return blocks[id]["fields"][inp][0]
+            value = []
+            self.inputs.append([id, value, inp in ["SUBSTACK", "SUBSTACK2"]])
+            return value
+        elif id == None:
+            # Blank value in bool input is null in sb3 but false in sb2
+            if not inp in ["SUBSTACK", "SUBSTACK2"]:
+                return False
         else:
-            # Handle other values
-            if value[0] == 10: # String value
-                value = value[1]
-            elif value[0] == 11: # Broadcast value
-                value = value[1]
-            elif value[0] == 12: # Variable reporter
-                self.blockIds.append(None) # TODO Calculate variable block id
-                value = ["readVariable", value[1]]
-            elif value[0] == 13: # List reporter
-                self.blockIds.append(None)
-                value = ["contentsOfList:", value[1]]
-            else:
-                log.warning("Invalid value type: '%s'" %value[1])
+            log.warning("Invalid block id: 's'" %id)
+        return id
 
-            return value
-        
+    def parseNumber(self, value):
+        """Handles number values, types 4 to 8."""
         # It's a number, try to convert it to one
-        value = self.specialNumber(value, True)
+        return self.specialNumber(value[1], True)
 
-        return value
+    def parseColor(self, value):
+        """Handles hex color values, type 9."""
+        try:
+            return int(value[1].strip("#"), 16)
+        except ValueError:
+            log.warning("Unable to convert hex: '%s'" %value[1])
+            return self.specialNumber(value[1], True)
+
+    def parseText(self, value):
+        """Handles string and broadcast values, types 10 and 11."""
+        return value[1]
+
+    def parseVariable(self, value):
+        """Handles variable reporters, type 12."""
+        self.indexBlock(None) # TODO Calculate variable block id
+        return ["readVariable", value[1]]
+
+    def parseList(self, value):
+        """Handles list reporters, type 13."""
+        self.indexBlock(None)
+        return ["contentsOfList:", value[1]]
 
     def specialNumber(self, value, toNumber=True):
         """Converts special strings to numbers."""
@@ -857,6 +2092,108 @@ class Converter:
                 pass # Normal
         return value
 
+    def convertTarget(self, target):
+        """Parses a target, reusing the sprite stored for an unchanged target."""
+        if not self.store:
+            return self.parseTarget(target)
+
+        # Fingerprint the target and the options which change the sprite
+        fingerprint = target.pop("fingerprint", None)
+        if not fingerprint:
+            data = json.dumps(target, separators=(",", ":")).encode("utf-8")
+            fingerprint = hashlib.md5(data).hexdigest()
+            data = None
+        if not self.specmapFingerprint:
+            self.specmapFingerprint = fingerprintSpecmap(self.specmap2, self.staticFields)
+        key = self.store.key("target", self.targetVersion, fingerprint, self.numberOpt, self.spaceOpt,
+            self.specmapFingerprint)
+
+        cached = self.store.get(key)
+        if cached:
+            try:
+                return self.reuseTarget(target, json.loads(cached[0]), cached[1])
+            except (ValueError, KeyError):
+                log.warning("Failed to reuse stored target '%s'.", target["name"], exc_info=True)
+
+        # Save the sprite without assets, their ids depend on the other targets
+        before = dict(self.stats["unknownOpcodes"])
+        sprite = self.parseTarget(target)
+        stored = dict(sprite, costumes=None)
+        if "sounds" in stored:
+            stored["sounds"] = None
+
+        # Save the statistics of the target too
+        info = {"blocks": self.blockCount, "comments": len(sprite.get("scriptComments", [])),
+            "unknownOpcodes": {}}
+        for opcode, count in self.stats["unknownOpcodes"].items():
+            if count != before.get(opcode, 0):
+                info["unknownOpcodes"][opcode] = count - before.get(opcode, 0)
+        self.store.put(key, json.dumps(stored, separators=(",", ":")).encode("utf-8"), info)
+        return sprite
+
+    def reuseTarget(self, target, sprite, info):
+        """Adds the assets and lists of a stored sprite to the project."""
+        log.debug("Reusing stored target '%s'.", target["name"])
+
+        # Lists are positioned once the monitors are parsed
+        for l, list2 in zip(target["lists"], sprite.get("lists", [])):
+            self.lists.append((l, list2))
+
+        sounds, costumes = self.parseAssets(target)
+        if "sounds" in sprite:
+            sprite["sounds"] = sounds
+        sprite["costumes"] = costumes
+
+        # Count the stored target in the statistics
+        self.stats["targets"] += 1
+        self.stats["blocks"] += info["blocks"]
+        self.stats["comments"] += info["comments"]
+        for opcode in info["unknownOpcodes"]:
+            unknown = self.stats["unknownOpcodes"]
+            unknown[opcode] = unknown.get(opcode, 0) + info["unknownOpcodes"][opcode]
+        return sprite
+
+    def parseAssets(self, target):
+        """Adds the sounds and costumes of a target to the filemap.
+
+        Returns the sb2 sounds and costumes of the target."""
+        # Get sounds
+        sounds = []
+        for sound in target["sounds"]:
+            if sound["assetId"] in self.filemap[0]:
+                sound2 = self.filemap[0][sound["assetId"]][1]
+            else:
+                sound2 = {
+                    "soundName": sound["name"],
+                    "soundID": len(self.filemap[0]),
+                    "md5": sound["md5ext"],
+                    "sampleCount": sound["sampleCount"],
+                    "rate": sound["rate"],
+                    "format": "format" in sound and sound["format"] or ""
+                }
+                self.filemap[0][sound["assetId"]] = [sound, sound2]
+            sounds.append(sound2)
+
+        # Get costumes
+        costumes = []
+        for costume in target["costumes"]:
+            if costume["assetId"] in self.filemap[1]:
+                costume2 = self.filemap[1][costume["assetId"]][1]
+            else:
+                costume2 = {
+                    "costumeName": costume["name"],
+                    "baseLayerID": len(self.filemap[1]),
+                    "baseLayerMD5": costume["md5ext"],
+                }
+                if "bitmapResolution" in costume:
+                    costume2["bitmapResolution"] = costume["bitmapResolution"]
+                costume2["rotationCenterX"] = costume["rotationCenterX"]
+                costume2["rotationCenterY"] = costume["rotationCenterY"]
+                
+                self.filemap[1][costume["assetId"]] = [costume, costume2]
+            costumes.append(costume2)
+        return sounds, costumes
+
     def parseMonitor(self, monitor):
         """Parse a sb3 monitor into an sb2 monitor."""
         param = ""
@@ -918,16 +2255,86 @@ class Converter:
             "visible": monitor["visible"]
         }
 
+class BlockSpec:
+    """A compiled specmap entry which converts one sb3 opcode."""
+    __slots__ = ["code", "argmap"]
+
+    def __init__(self, code, argmap, lower=False):
+        """Compiles the argmap into (isField, name, lower) tuples.
+
+        lower -- lowercase the fields, some are all caps for some reason"""
+        self.code = code
+        self.argmap = tuple((arg[0] == "field", arg[1], lower and arg[0] == "field") for arg in argmap)
+
+    def __call__(self, block3, blocks, current):
+        """Adds the sb2 block id and returns the argmap."""
+        current.append(self.code)
+        return self.argmap
+
+_compiled = {} # Handlers and md5s of specmaps from loadSpecmap by kind, id and static fields
+
+def compileSpecmap(specmap2, staticFields=()):
+    """Returns a dict of BlockSpec handlers for a specmap.
+
+    Specmaps from loadSpecmap stay loaded, so they are only compiled once."""
+    key = ("handlers", id(specmap2), tuple(staticFields))
+    if key in _compiled:
+        return _compiled[key]
+
+    handlers = {}
+    for opcode in specmap2:
+        code, argmap = specmap2[opcode]
+        handlers[opcode] = BlockSpec(code, argmap, opcode in staticFields)
+    _keepCompiled(key, specmap2, handlers)
+    return handlers
+
+def fingerprintSpecmap(specmap2, staticFields=()):
+    """Returns the md5 of a specmap and its static fields.
+
+    Specmaps from loadSpecmap stay loaded, so they are only hashed once."""
+    key = ("md5", id(specmap2), tuple(staticFields))
+    if key in _compiled:
+        return _compiled[key]
+
+    data = json.dumps([specmap2, list(staticFields)], sort_keys=True).encode("utf-8")
+    md5 = hashlib.md5(data).hexdigest()
+    _keepCompiled(key, specmap2, md5)
+    return md5
+
+def _keepCompiled(key, specmap2, result):
+    """Keeps the result for a specmap from loadSpecmap.
+
+    Other specmaps may be freed and their id reused, so they are not kept."""
+    for loaded in _specmaps.values():
+        if loaded is specmap2:
+            _compiled[key] = result
+
 # Run the program if not imported as a module
 if __name__ == "__main__":
     # Parse arguments
+    import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("sb3_path", help="path to the .sb3 or .sprite3 project/sprite, defaults to './project.sb3'", nargs="?", default="./project.sb3")
-    parser.add_argument("sb2_path", help="path to the .sb2 or .sprite2 project/sprite, default generated from sb3_path", nargs="?", default="")
+    parser.add_argument("sb3_path", help="path to the .sb3 or .sprite3 project/sprite, defaults to './project.sb3'; a folder or glob pattern converts every file it matches", nargs="?", default="./project.sb3")
+    parser.add_argument("sb2_path", help="path to the .sb2 or .sprite2 project/sprite, default generated from sb3_path; the output folder when converting many files", nargs="?", default="")
     parser.add_argument("-w", "--overwrite", help="overwrite existing files at the sb2 destination", action="store_true")
     parser.add_argument("-d", "--debug", help="save a debug json to './project.json' or './sprite.json' when overwrite is enabled", action="store_true")
     parser.add_argument("-v", "--verbosity", help="controls printed verbosity", action="count", default=0)
     parser.add_argument("-o", "--optimize", help="try to convert all strings to numbers", action="store_true")
+    parser.add_argument("-j", "--jobs", help="number of worker processes when converting many files, defaults to the cpu count", type=int, default=None)
+    parser.add_argument("-c", "--cache", help="folder to keep converted sounds in for later runs", default="")
+    parser.add_argument("--cache-size", help="size limit of the cache folder in megabytes, defaults to 256", type=int, default=256)
+    parser.add_argument("-z", "--compress", help="deflate the sb2, except for already compressed assets", action="store_true")
+    parser.add_argument("--compress-level", help="deflate level from 0 to 9, defaults to 6, implies --compress", type=int, choices=range(10), metavar="LEVEL", default=None)
+    parser.add_argument("-s", "--stream", help="parse the project json one target at a time to save memory", action="store_true")
+    parser.add_argument("-p", "--pretty", help="indent the json saved in the sb2", action="store_true")
+    parser.add_argument("-i", "--integrity", help="off uses asset ids as md5s, trust only hashes ids which are not md5s and full checks every asset, defaults to trust", choices=SbFiles.integrities, default="trust")
+    parser.add_argument("--downscale", help="halve bitmaps with a resolution of 2 if it makes them smaller, needs Pillow", action="store_true")
+    parser.add_argument("--png-level", help="deflate png costumes again at this level from 0 to 9 if it makes them smaller", type=int, choices=range(10), metavar="LEVEL", default=None)
+    parser.add_argument("--specmap", help="path to the sb3 to sb2 specmap json, defaults to specmap2.json next to SbC3.py", metavar="PATH", default="")
+    parser.add_argument("-q", "--quality", help="sound resampling quality, defaults to fast", choices=sbaudio.qualities, default="fast")
+    parser.add_argument("--profile", help="save the time and memory used by each phase to a json file", metavar="PATH", default="")
+    parser.add_argument("--cprofile", help="add the slowest functions found by cProfile to the profile", action="store_true")
+    parser.add_argument("--stats", help="append statistics about each converted file to a json lines file", metavar="PATH", default="")
     args = parser.parse_args()
     
     # A bit more parsing
@@ -937,6 +2344,15 @@ if __name__ == "__main__":
     debug = args.debug
     verbosity = args.verbosity
     optimize = args.optimize
+    jobs = args.jobs
+    options = {"quality": args.quality, "compact": not args.pretty, "stream": args.stream, "integrity": args.integrity,
+        "downscale": args.downscale, "pngLevel": args.png_level, "specmap_path": args.specmap}
+    if args.compress or args.compress_level != None:
+        options["compression"] = "deflate"
+        options["compressLevel"] = args.compress_level
+    cache = None
+    if args.cache:
+        cache = AssetCache(args.cache, args.cache_size * 1024 * 1024)
 
     # Get the verbosity level
     if verbosity == 0:
@@ -951,5 +2367,34 @@ if __name__ == "__main__":
     # Configure the logger verbosity
     log.level = verbosity
 
-    # Run the converter with these arguments
-    main(sb3_path, sb2_path, overwrite, optimize, debug)
+    if os.path.isdir(sb3_path) or any(c in sb3_path for c in "*?["):
+        # Convert every project in the folder or pattern
+        if debug:
+            log.warning("Debug json is not saved when converting many files.")
+        if args.profile:
+            log.warning("Profiles are not saved when converting many files.")
+        sb3_paths = findProjects([sb3_path])
+        failed = []
+        for path, success in convertMany(sb3_paths, sb2_path, jobs, overwrite, optimize, cache, args.stats, **options):
+            if success:
+                print("Converted '%s'" % path)
+            else:
+                print("Failed '%s'" % path)
+                failed.append(path)
+
+        # Print a summary of the results
+        print("Converted %i of %i files." % (len(sb3_paths) - len(failed), len(sb3_paths)))
+        for path in failed:
+            print("Failed to convert '%s'" % path)
+    else:
+        # Run the converter with these arguments
+        profiler = None
+        if args.profile:
+            profiler = Profiler(cprofile=args.cprofile)
+        stats = {}
+        main(sb3_path, sb2_path, overwrite, optimize, debug, cache, profiler=profiler, stats=stats, **options)
+        if args.stats:
+            saveStats(args.stats, stats)
+        if profiler:
+            profiler.save(args.profile)
+            print("Saved profile to '%s'" % args.profile)
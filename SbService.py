@@ -0,0 +1,283 @@
+# Sb3 to Sb2 Conversion Service
+# Converts uploaded sb3 files over HTTP using a pool of warm worker processes
+
+import argparse
+import json, os, sys, time
+import socketserver, threading
+from collections import deque
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+from http import server
+from urllib import parse
+
+import SbC3
+
+log = SbC3.log
+
+def main(host="127.0.0.1", port=8080, unix_path="", workers=None, maxSize=64, maxQueue=256):
+    """Runs the conversion service until interrupted.
+
+    host, port -- the address to listen on
+    unix_path -- listen on this unix socket instead of host and port
+    workers -- the number of worker processes, defaults to the cpu count
+    maxSize -- the largest accepted upload in megabytes
+    maxQueue -- the most conversions waiting or running before refusing more"""
+    service = Service(workers, maxSize * 1024 * 1024, maxQueue)
+
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        httpd = UnixHTTPServer(unix_path, Handler)
+        print("Listening on '%s'" % unix_path)
+    else:
+        httpd = server.ThreadingHTTPServer((host, port), Handler)
+        print("Listening on http://%s:%i" % httpd.server_address[:2])
+    httpd.service = service
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+        if unix_path and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+class Service:
+    """Runs conversions on a pool of warm workers and tracks metrics."""
+
+    options = { # Allowed values of each option
+        "optimize": bool, "compact": bool, "stream": bool, "downscale": bool,
+        "quality": SbC3.sbaudio.qualities,
+        "compression": list(SbC3.SbFiles.compressions),
+        "integrity": SbC3.SbFiles.integrities,
+        "compressLevel": range(10), "pngLevel": range(10)
+    }
+    booleans = {"true": True, "1": True, "false": False, "0": False} # Values of bool options
+
+    def __init__(self, workers=None, maxSize=64 * 1024 * 1024, maxQueue=256):
+        """Starts the worker processes and waits until they are ready."""
+        self.maxSize = maxSize
+        self.maxQueue = maxQueue
+        self.metrics = Metrics()
+        self.workers = workers or os.cpu_count() or 1
+        self.lock = threading.Lock()
+        self.pool = self.startPool()
+
+    def startPool(self):
+        """Returns a new pool of workers which are all started."""
+        pool = futures.ProcessPoolExecutor(self.workers, initializer=_initWorker,
+            initargs=(log.level,))
+
+        # Start every worker now so the first uploads are not slowed down
+        list(pool.map(_ready, range(self.workers)))
+        log.info("Started %i workers.", self.workers)
+        return pool
+
+    def parseOptions(self, query):
+        """Returns the conversion options in a url query.
+
+        Raises ValueError if an option is unknown or has an invalid value."""
+        options = {}
+        for key, value in parse.parse_qsl(query):
+            if not key in self.options:
+                raise ValueError("Unkown option '%s'" % key)
+            allowed = self.options[key]
+            if allowed == bool:
+                if not value.lower() in self.booleans:
+                    raise ValueError("Option '%s' must be true or false" % key)
+                value = self.booleans[value.lower()]
+            else:
+                if type(allowed) == range:
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        raise ValueError("Option '%s' must be a number" % key)
+                if not value in allowed:
+                    raise ValueError("Invalid value for option '%s'" % key)
+            options[key] = value
+        return options
+
+    def convert(self, data, options):
+        """Converts sb3 bytes, returns the sb2 bytes or None on failure.
+
+        Raises QueueFull if too many conversions are waiting."""
+        if not self.metrics.start(self.maxQueue):
+            raise QueueFull()
+        start = time.perf_counter()
+        result = None
+        pool = self.pool
+        try:
+            result = pool.submit(_convert, data, options).result()
+        except BrokenProcessPool:
+            # A worker died, the pool can not be used again
+            log.error("A conversion worker stopped unexpectedly, restarting the workers.")
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = self.startPool()
+                    pool.shutdown(wait=False)
+        except:
+            log.error("Unkown error in conversion worker.", exc_info=True)
+        finally:
+            self.metrics.finish(time.perf_counter() - start, result != None)
+        return result
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+class QueueFull(Exception):
+    """Raised when the service has too many conversions waiting."""
+
+class Metrics:
+    """Thread safe counters and latencies of the conversions."""
+
+    def __init__(self, samples=1000):
+        self.lock = threading.Lock()
+        self.queued = 0 # Conversions waiting or running
+        self.completed = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=samples) # The most recent latencies
+
+    def start(self, maxQueue):
+        """Counts a new conversion, returns False if the queue is full."""
+        with self.lock:
+            if self.queued >= maxQueue:
+                self.rejected += 1
+                return False
+            self.queued += 1
+            return True
+
+    def finish(self, latency, success):
+        with self.lock:
+            self.queued -= 1
+            self.latencies.append(latency)
+            if success:
+                self.completed += 1
+            else:
+                self.errors += 1
+
+    def report(self):
+        """Returns the metrics as a json serializable dict."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            report = {
+                "queued": self.queued,
+                "completed": self.completed,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "latency": {}
+            }
+        for p in [50, 90, 99]:
+            if latencies:
+                index = min(len(latencies) - 1, len(latencies) * p // 100)
+                report["latency"]["p%i" % p] = round(latencies[index] * 1000, 3)
+            else:
+                report["latency"]["p%i" % p] = None
+        report["latency"]["samples"] = len(latencies)
+        return report
+
+class Handler(server.BaseHTTPRequestHandler):
+    """Handles POST /convert and GET /metrics."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.reply(200, json.dumps(self.server.service.metrics.report()).encode("utf-8"),
+                "application/json")
+        else:
+            self.reply(404, b"Not found\n")
+
+    def do_POST(self):
+        url = parse.urlsplit(self.path)
+        if url.path != "/convert":
+            self.reply(404, b"Not found\n")
+            return
+
+        # Read the upload
+        service = self.server.service
+        try:
+            size = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.reply(411, b"Content-Length required\n")
+            return
+        if size < 0:
+            self.reply(400, b"Invalid Content-Length\n")
+            return
+        if size > service.maxSize:
+            self.reply(413, b"Upload too large\n")
+            return
+        data = self.rfile.read(size)
+
+        # Get conversion options from the query
+        try:
+            options = service.parseOptions(url.query)
+        except ValueError as e:
+            self.reply(400, ("%s\n" % e).encode("utf-8"))
+            return
+
+        try:
+            sb2 = service.convert(data, options)
+        except QueueFull:
+            self.reply(503, b"Too many conversions waiting\n")
+            return
+        if sb2 == None:
+            self.reply(422, b"Conversion failed\n")
+        else:
+            self.reply(200, sb2, "application/zip")
+
+    def reply(self, code, body, contentType="text/plain"):
+        self.send_response(code)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        if type(self.client_address) == tuple:
+            return self.client_address[0]
+        return self.server.server_address # Unix socket
+
+    def log_message(self, format, *args):
+        log.info("%s - %s", self.address_string(), format % args)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A threading HTTP server listening on a unix socket."""
+    daemon_threads = True
+
+# Set up in each worker process
+_converter = None
+
+def _initWorker(level):
+    """Warms up a worker with a reusable Converter."""
+    global _converter
+    log.level = level
+    sys.stdout = open(os.devnull, "w") # Hide "Saved to" messages
+    _converter = SbC3.Converter(None, SbC3.loadSpecmap())
+
+def _ready(i):
+    return os.getpid()
+
+def _convert(data, options):
+    """Converts sb3 bytes in a worker, returns the sb2 bytes or None."""
+    options = dict(options)
+    optimize = options.pop("optimize", False)
+    return SbC3.convertBytes(data, optimize, converter=_converter, **options)
+
+# Run the service if not imported as a module
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Converts sb3 files posted to /convert, metrics are at /metrics.")
+    parser.add_argument("--host", help="address to listen on, defaults to 127.0.0.1", default="127.0.0.1")
+    parser.add_argument("--port", help="port to listen on, defaults to 8080", type=int, default=8080)
+    parser.add_argument("--unix", help="listen on a unix socket at this path instead", default="")
+    parser.add_argument("-j", "--jobs", help="number of worker processes, defaults to the cpu count", type=int, default=None)
+    parser.add_argument("--max-size", help="largest accepted upload in megabytes, defaults to 64", type=int, default=64)
+    parser.add_argument("--max-queue", help="most conversions waiting before refusing more, defaults to 256", type=int, default=256)
+    parser.add_argument("-v", "--verbosity", help="controls printed verbosity", action="count", default=0)
+    args = parser.parse_args()
+
+    # Configure the logger verbosity
+    log.level = [30, 20, 10][min(args.verbosity, 2)]
+
+    main(args.host, args.port, args.unix, args.jobs, args.max_size, args.max_queue)
@@ -0,0 +1,87 @@
+# Compares the sbaudio engines against the audioop conversion used before
+# Run from the repository root: python bench/bench_audio.py [project.sb3]
+
+import io, os, sys, time, wave, zipfile, warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sbaudio
+
+def loadSounds(path):
+    """Returns (name, frames, channels, width, rate) for each wav in a sb3."""
+    sounds = []
+    with zipfile.ZipFile(path) as sb3:
+        for name in sb3.namelist():
+            if name.endswith(".wav"):
+                try:
+                    wav = wave.open(io.BytesIO(sb3.read(name)), "rb")
+                except wave.Error:
+                    continue # adpcm
+                frames = wav.readframes(wav.getnframes())
+                sounds.append((name, frames, wav.getnchannels(), wav.getsampwidth(), wav.getframerate()))
+    return sounds
+
+def stereo(frames, width, seconds, rate):
+    """Repeats mono frames into a long stereo track."""
+    frames = frames * (seconds * rate * width // len(frames) + 1)
+    frames = frames[:seconds * rate * width]
+    out = bytearray(len(frames) * 2)
+    for i in range(width):
+        out[i::2 * width] = frames[i::width]
+        out[width + i::2 * width] = frames[i::width]
+    return bytes(out)
+
+def snr(reference, result, width):
+    """Returns the signal to noise ratio of result against reference in dB."""
+    numpy = sbaudio.numpy
+    a = sbaudio.decode(reference, width)
+    b = sbaudio.decode(result, width)
+    count = min(len(a), len(b))
+    a, b = a[:count], b[:count]
+    noise = numpy.sum((a - b) ** 2)
+    if noise == 0:
+        return float("inf")
+    return 10 * numpy.log10(numpy.sum(a ** 2) / noise)
+
+def timeit(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return best, result
+
+def run(path):
+    sbaudio.loadEngines()
+    if not sbaudio.numpy or not sbaudio.audioop:
+        print("This benchmark needs both numpy and audioop.")
+        return
+
+    sounds = loadSounds(path)
+    cases = []
+    for name, frames, channels, width, rate in sounds:
+        # Resample the bundled sounds as they are
+        cases.append((name, frames, channels, width, rate, rate // 2))
+        cases.append((name, frames, channels, width, rate, 44100))
+    if sounds:
+        # A long stereo track at an unsupported rate
+        name, frames, channels, width, rate = sounds[-1]
+        if channels == 1:
+            frames = stereo(frames, width, 60, rate)
+            cases.append(("60s stereo", frames, 2, width, 48000, 44100))
+            cases.append(("60s stereo", frames, 2, width, 48000, 11025))
+
+    print("%-40s %6s %10s %10s %10s %8s %8s" % ("sound", "width", "audioop", "fast", "best", "snr fast", "snr best"))
+    for name, frames, channels, width, rate, newRate in cases:
+        args = (frames, channels, width, rate, newRate, width)
+        tA, reference = timeit(lambda: sbaudio.convert(*args, engine="audioop"))
+        tF, fast = timeit(lambda: sbaudio.convert(*args, quality="fast", engine="numpy"))
+        tB, best = timeit(lambda: sbaudio.convert(*args, quality="best", engine="numpy"))
+        print("%-40s %6i %9.2fms %9.2fms %9.2fms %7.1fdB %7.1fdB" % (
+            "%s %i->%i" % (name[:24], rate, newRate), width, tA * 1000, tF * 1000,
+            tB * 1000, snr(reference, fast, width), snr(reference, best, width)))
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore", DeprecationWarning)
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    run(sys.argv[1] if len(sys.argv) > 1 else os.path.join(root, "project_sb3.sb3"))
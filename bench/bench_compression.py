@@ -0,0 +1,36 @@
+# Measures sb2 size and conversion time for each compression setting
+# Run from the repository root: python bench/bench_compression.py [project.sb3 ...]
+
+import os, subprocess, sys, tempfile, time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+script = os.path.join(root, "SbC3.py")
+
+settings = [
+    ("stored", []),
+    ("deflate 1", ["--compress-level", "1"]),
+    ("deflate 6", ["--compress-level", "6"]),
+    ("deflate 9", ["--compress-level", "9"]),
+]
+
+def run(paths, repeat=3):
+    print("%-30s %-10s %10s %8s %10s" % ("project", "setting", "size", "ratio", "time"))
+    with tempfile.TemporaryDirectory() as folder:
+        sb2_path = os.path.join(folder, "project.sb2")
+        for path in paths:
+            stored = None
+            for name, args in settings:
+                best = None
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    subprocess.run([sys.executable, script, path, sb2_path, "-w"] + args,
+                        check=True, stdout=subprocess.DEVNULL)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best == None else min(best, elapsed)
+                size = os.path.getsize(sb2_path)
+                stored = stored or size
+                print("%-30s %-10s %10i %7.1f%% %8.1fms" % (os.path.basename(path)[:30],
+                    name, size, size * 100 / stored, best * 1000))
+
+if __name__ == "__main__":
+    run(sys.argv[1:] or [os.path.join(root, "project_sb3.sb3")])
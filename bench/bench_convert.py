@@ -0,0 +1,127 @@
+# Times each conversion phase on generated projects and records the results
+# Run from the repository root: python bench/bench_convert.py [--sizes small medium] [--repeat N]
+
+import argparse, io, json, os, platform, subprocess, sys, tempfile, time, zipfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+import SbC3
+import generate
+
+def best(func, repeat):
+    """Returns the shortest time in seconds of repeated calls."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run(size, folder, repeat=3):
+    """Generates a project of a preset size and times each phase."""
+    sb3_path = os.path.join(folder, size + ".sb3")
+    sb2_path = os.path.join(folder, size + ".sb2")
+    blocks = generate.generate(sb3_path, **generate.sizes[size])
+    with zipfile.ZipFile(sb3_path) as sb3:
+        project = json.loads(sb3.read("project.json"))
+    result = {"size": size, "blocks": blocks}
+
+    # Converter.convert on the whole project
+    converter = SbC3.Converter(None, SbC3.loadSpecmap())
+    def convert():
+        converter.reset(project)
+        converter.convert()
+    result["convert"] = best(convert, repeat)
+
+    # Converter.parseScript on every script
+    scripts = []
+    for target in project["targets"]:
+        for id in target["blocks"]:
+            block = target["blocks"][id]
+            if type(block) == dict and block["topLevel"]:
+                scripts.append((id, target["blocks"]))
+    def parseScripts():
+        converter.reset()
+        for id, blocks in scripts:
+            converter.parseScript(id, blocks)
+    result["parseScript"] = best(parseScripts, repeat)
+    result["parseScriptPerBlock"] = result["parseScript"] / max(converter.blockCount, 1)
+
+    # SbFiles.processWave on every sound
+    sbf = SbC3.SbFiles(sb3_path, sb2_path, True)
+    sounds = []
+    for target in project["targets"]:
+        for sound in target["sounds"]:
+            sounds.append((sbf.sb3_file.read(sound["md5ext"]),
+                {"md5": sound["md5ext"], "format": "", "soundName": sound["name"]}))
+    def processWaves():
+        for data, asset in sounds:
+            sbf.processWave(data, dict(asset))
+    result["processWave"] = best(processWaves, repeat)
+    sbf.close()
+
+    # SbFiles.saveSb2 on the converted project
+    def saveSb2():
+        sbf = SbC3.SbFiles(sb3_path, sb2_path, True)
+        converter.reset(sbf.getSb3())
+        sb2, filemap = converter.convert()
+        start = time.perf_counter()
+        sbf.saveSb2(sb2, filemap)
+        elapsed = time.perf_counter() - start
+        sbf.close()
+        return elapsed
+    result["saveSb2"] = min(saveSb2() for i in range(repeat))
+    return result
+
+def commit():
+    """Returns the current git commit, or None outside a repository."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous(path, size):
+    """Returns the last recorded result for a size."""
+    last = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["size"] == size:
+                    last = record
+    return last
+
+phases = ["convert", "parseScript", "processWave", "saveSb2"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the conversion phases on generated projects.")
+    parser.add_argument("--sizes", nargs="+", choices=list(generate.sizes), default=["small", "medium"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="results file, defaults to bench/results.jsonl",
+        default=os.path.join(root, "bench", "results.jsonl"))
+    args = parser.parse_args()
+    SbC3.log.level = 40 # Hide warnings and info
+    sys.stdout, stdout = io.StringIO(), sys.stdout # Hide "Saved to" messages
+
+    records = []
+    with tempfile.TemporaryDirectory() as folder:
+        for size in args.sizes:
+            record = run(size, folder, args.repeat)
+            record.update({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit(),
+                "python": platform.python_version(), "engine": SbC3.sbaudio.loadEngines()})
+            records.append((record, previous(args.output, size)))
+    sys.stdout = stdout
+
+    # Print the results compared with the last run
+    print("%-8s %-12s %12s %12s %8s" % ("size", "phase", "time", "previous", "change"))
+    with open(args.output, "a") as f:
+        for record, last in records:
+            for phase in phases:
+                line = "%-8s %-12s %10.2fms" % (record["size"], phase, record[phase] * 1000)
+                if last:
+                    line += " %10.2fms %+7.1f%%" % (last[phase] * 1000,
+                        (record[phase] / last[phase] - 1) * 100)
+                print(line)
+            f.write(json.dumps(record) + "\n")
+    print("Results appended to '%s'" % args.output)
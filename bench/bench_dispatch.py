@@ -0,0 +1,41 @@
+# Measures the cost per block of Converter.parseScript
+# Run from the repository root: python bench/bench_dispatch.py [project.sb3] [repeat]
+
+import json, os, sys, time, zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import SbC3
+
+def run(sb3_path, repeat=200):
+    with zipfile.ZipFile(sb3_path) as sb3:
+        project = json.loads(sb3.read("project.json"))
+
+    # Find every script in the project
+    scripts = []
+    for target in project["targets"]:
+        blocks = target["blocks"]
+        for id in blocks:
+            if type(blocks[id]) == dict and blocks[id]["topLevel"]:
+                scripts.append((id, blocks))
+
+    converter = SbC3.Converter(None, SbC3.loadSpecmap())
+    SbC3.log.level = 50 # Hide warnings about unconvertable blocks
+
+    best = None
+    for i in range(repeat):
+        converter.reset()
+        start = time.perf_counter()
+        for id, blocks in scripts:
+            converter.parseScript(id, blocks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+
+    count = converter.blockCount
+    print("%i scripts, %i blocks: %.3fms per pass, %.3fus per block" % (
+        len(scripts), count, best * 1000, best * 1e6 / count))
+
+if __name__ == "__main__":
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    sb3_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(root, "project_sb3.sb3")
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    run(sb3_path, repeat)
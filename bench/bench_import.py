@@ -0,0 +1,68 @@
+# Measures how long importing SbC3 and converting a small project take from a cold start
+# Run from the repository root: python bench/bench_import.py [--budget MS] [--repeat N]
+
+import argparse, os, subprocess, sys, tempfile, time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Modules which should only be imported by the features that use them
+deferred = ["numpy", "audioop", "PIL", "asyncio", "argparse", "wave", "glob", "tracemalloc", "xml.sax"]
+
+def importTimes():
+    """Imports SbC3 in a new interpreter.
+
+    Returns the cumulative time in us and import depth of each module."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import SbC3"], cwd=root,
+        capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:   self |   cumulative |   name"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self, cumulative, name = line[12:].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2 # Nested imports are indented
+        times[name.strip()] = (int(cumulative), depth)
+    return times
+
+def convertTime(folder):
+    """Returns the seconds a new interpreter takes to convert the test project."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "SbC3.py", "project_sb3.sb3", os.path.join(folder, "project.sb2"), "-w"],
+        cwd=root, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the cold start time of the converter.")
+    parser.add_argument("--budget", help="most milliseconds importing SbC3 may take, defaults to 100", type=float, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Keep the fastest import, the others were slowed by something else
+    best = None
+    for i in range(args.repeat):
+        times = importTimes()
+        if best == None or times["SbC3"][0] < best["SbC3"][0]:
+            best = times
+    total = best["SbC3"][0] / 1000
+
+    # Show the slowest modules imported directly by SbC3
+    direct = [(name, cumulative) for name, (cumulative, depth) in best.items() if depth == 1]
+    for name, cumulative in sorted(direct, key=lambda item: item[1], reverse=True)[:10]:
+        print("%-24s %8.2fms" % (name, cumulative / 1000))
+    print("%-24s %8.2fms" % ("import SbC3", total))
+
+    with tempfile.TemporaryDirectory() as folder:
+        print("%-24s %8.2fms" % ("convert project_sb3", min(convertTime(folder) for i in range(args.repeat)) * 1000))
+
+    # Check the budget and that slow modules are still deferred
+    failed = False
+    imported = [name for name in deferred if name in best]
+    if imported:
+        print("Imported on startup: %s" % ", ".join(imported))
+        failed = True
+    if total > args.budget:
+        print("Importing SbC3 took %.2fms, over the budget of %.2fms." % (total, args.budget))
+        failed = True
+    else:
+        print("Within the budget of %.2fms." % args.budget)
+    sys.exit(failed and 1 or 0)
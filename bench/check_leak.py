@@ -0,0 +1,51 @@
+# Converts a project many times with one Converter and checks memory stays flat
+# Run from the repository root: python bench/check_leak.py [project.sb3] [count]
+
+import contextlib, gc, io, os, sys, tempfile, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import SbC3
+
+def convert(converter, sb3_path, sb2_path):
+    """Converts a project reusing the converter, like a warm worker."""
+    sbf = SbC3.SbFiles(sb3_path, sb2_path, overwrite=True)
+    try:
+        converter.reset(sbf.getSb3())
+        sb2, filemap = converter.convert()
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sbf.saveSb2(sb2, filemap)
+    finally:
+        sbf.close()
+        converter.reset()
+
+def run(sb3_path, count=2000, warmup=50, limit=256 * 1024):
+    """Returns True if memory grew less than limit bytes after the warmup."""
+    converter = SbC3.Converter(None, SbC3.loadSpecmap())
+    with tempfile.TemporaryDirectory() as folder:
+        sb2_path = os.path.join(folder, "project.sb2")
+        for i in range(warmup):
+            convert(converter, sb3_path, sb2_path)
+
+        gc.collect()
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(count):
+            if not convert(converter, sb3_path, sb2_path):
+                print("Conversion %i failed." % i)
+                return False
+            if (i + 1) % (count // 10 or 1) == 0:
+                gc.collect()
+                current = tracemalloc.get_traced_memory()[0]
+                print("%6i conversions: %+8i bytes" % (i + 1, current - start))
+        gc.collect()
+        growth = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+
+    print("Memory grew %i bytes over %i conversions, limit %i." % (growth, count, limit))
+    return growth < limit
+
+if __name__ == "__main__":
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    sb3_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(root, "project_sb3.sb3")
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    sys.exit(0 if run(sb3_path, count) else 1)
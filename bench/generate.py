@@ -0,0 +1,252 @@
+# Generates synthetic sb3 projects for benchmarking the converter
+# Run from the repository root: python bench/generate.py output.sb3 [--targets N] [--blocks N] ...
+
+import argparse, hashlib, json, math, random, struct, zipfile, zlib
+
+sizes = { # Preset sizes used by bench_convert.py
+    "small": {"targets": 2, "scripts": 5, "blocks": 20, "depth": 2, "comments": 5,
+        "lists": 1, "listSize": 10, "sounds": 1, "costumes": 1},
+    "medium": {"targets": 8, "scripts": 20, "blocks": 100, "depth": 4, "comments": 200,
+        "lists": 4, "listSize": 1000, "sounds": 4, "costumes": 4},
+    "large": {"targets": 20, "scripts": 50, "blocks": 500, "depth": 8, "comments": 5000,
+        "lists": 8, "listSize": 20000, "sounds": 8, "costumes": 8}
+}
+
+def generate(path, targets=2, scripts=5, blocks=20, depth=2, comments=0, lists=0, listSize=0,
+        sounds=0, costumes=1, soundSeconds=1, seed=1):
+    """Writes a sb3 project and returns the number of blocks in it.
+
+    targets -- the number of sprites, not counting the stage
+    scripts -- the number of scripts in each target
+    blocks -- the number of stack blocks in each script
+    depth -- how deeply the loops in each script are nested
+    comments -- the number of comments in each target
+    lists, listSize -- the number of lists in each target and their length
+    sounds -- the number of stereo 44.1kHz wav sounds in each target
+    costumes -- the number of costumes in each target, alternating svg and png
+    soundSeconds -- the length of each sound
+    seed -- the random seed, the same arguments always give the same project"""
+    generator = Generator(random.Random(seed), soundSeconds)
+    project = {"targets": [], "monitors": [], "extensions": [], "meta": {"semver": "3.0.0"}}
+    count = 0
+    for t in range(targets + 1):
+        target = generator.target(t, scripts, blocks, depth, comments, lists, listSize, sounds, costumes)
+        project["targets"].append(target)
+        count += len(target["blocks"])
+
+        # Show the first list of each target
+        for id in list(target["lists"])[:1]:
+            project["monitors"].append({"id": id, "mode": "list", "opcode": "data_listcontents",
+                "params": {"LIST": target["lists"][id][0]}, "spriteName": None if t == 0 else target["name"],
+                "value": [], "width": 0, "height": 0, "x": 5, "y": 5, "visible": True})
+
+    with zipfile.ZipFile(path, "w") as sb3:
+        sb3.writestr("project.json", json.dumps(project))
+        for md5ext in generator.assets:
+            sb3.writestr(md5ext, generator.assets[md5ext])
+    return count
+
+class Generator:
+    """Builds the targets and assets of a synthetic project."""
+
+    def __init__(self, random, soundSeconds=1):
+        self.random = random
+        self.soundSeconds = soundSeconds
+        self.assets = {} # Asset data by md5ext
+        self.nextId = 0
+
+    def newId(self):
+        self.nextId += 1
+        return "id%i" % self.nextId
+
+    def target(self, index, scripts, blocks, depth, comments, lists, listSize, sounds, costumes):
+        """Returns a target, the first one is the stage."""
+        isStage = index == 0
+        self.blocks = {}
+        self.variable = [self.newId(), "var%i" % index]
+
+        # Add a custom block which every script calls
+        self.proccode = "block%i %%s %%b" % index
+        self.argumentIds = [self.newId(), self.newId()]
+        self.customBlock()
+
+        for s in range(scripts):
+            self.script(s, blocks, depth)
+
+        target = {
+            "isStage": isStage,
+            "name": "Stage" if isStage else "Sprite%i" % index,
+            "variables": {self.variable[0]: [self.variable[1], 0]},
+            "lists": {},
+            "broadcasts": {},
+            "blocks": self.blocks,
+            "comments": {},
+            "currentCostume": 0,
+            "costumes": [self.costume(c) for c in range(costumes)],
+            "sounds": [self.sound(s) for s in range(sounds)],
+            "layerOrder": index,
+            "volume": 100
+        }
+        if not isStage:
+            target.update({"visible": True, "x": 0, "y": 0, "size": 100, "direction": 90,
+                "draggable": False, "rotationStyle": "all around"})
+
+        for l in range(lists):
+            items = [self.random.choice(["item", 12, "3.5", ""]) for i in range(listSize)]
+            target["lists"][self.newId()] = ["list%i" % l, items]
+
+        ids = [id for id in self.blocks if not self.blocks[id]["shadow"]]
+        for c in range(comments):
+            target["comments"][self.newId()] = {"blockId": self.random.choice(ids), "x": 10, "y": 10,
+                "width": 200, "height": 200, "minimized": c % 2 == 0, "text": "comment %i" % c}
+        return target
+
+    def add(self, block, parent=None, topLevel=False):
+        """Adds a block to the target and returns its id."""
+        id = self.newId()
+        block.update({"next": None, "parent": parent, "shadow": block.get("shadow", False),
+            "topLevel": topLevel})
+        block.setdefault("inputs", {})
+        block.setdefault("fields", {})
+        if topLevel:
+            block["x"] = self.random.randint(0, 2000)
+            block["y"] = self.random.randint(0, 2000)
+        self.blocks[id] = block
+        return id
+
+    def customBlock(self):
+        """Adds a custom block definition."""
+        definition = self.add({"opcode": "procedures_definition"}, topLevel=True)
+        prototype = self.add({"opcode": "procedures_prototype", "shadow": True, "mutation": {
+            "tagName": "mutation", "children": [], "proccode": self.proccode,
+            "argumentids": json.dumps(self.argumentIds),
+            "argumentnames": json.dumps(["text", "flag"]),
+            "argumentdefaults": json.dumps(["", "false"]), "warp": "false"}}, definition)
+        self.blocks[definition]["inputs"]["custom_block"] = [1, prototype]
+
+        say = self.add({"opcode": "looks_say"}, definition)
+        reporter = self.add({"opcode": "argument_reporter_string_number",
+            "fields": {"VALUE": ["text", None]}}, say)
+        self.blocks[say]["inputs"]["MESSAGE"] = [3, reporter, [10, "Hello!"]]
+        self.blocks[definition]["next"] = say
+
+    def script(self, index, blocks, depth):
+        """Adds a script with a hat block and nested loops."""
+        hat = self.add({"opcode": "event_whenflagclicked"}, topLevel=True)
+        self.stack(hat, blocks, depth)
+
+    def stack(self, parent, count, depth, inside=False):
+        """Adds count blocks under parent and returns the first block's id.
+
+        Half way through, the rest of the blocks go inside a loop."""
+        first = None
+        previous = parent
+        for i in range(count):
+            nest = depth > 0 and i == count // 2
+            if nest:
+                id = self.add({"opcode": "control_repeat"}, previous)
+                self.blocks[id]["inputs"]["TIMES"] = [1, [6, "10"]]
+            else:
+                id = self.block(previous, i)
+
+            # Link the block to the one before it
+            if first == None:
+                first = id
+                if not inside:
+                    self.blocks[parent]["next"] = id
+            else:
+                self.blocks[previous]["next"] = id
+            previous = id
+
+            if nest:
+                substack = self.stack(id, count - i - 1, depth - 1, True)
+                if substack:
+                    self.blocks[id]["inputs"]["SUBSTACK"] = [2, substack]
+                break
+        return first
+
+    def block(self, parent, index):
+        """Adds a stack block with some reporter and value inputs."""
+        kind = index % 4
+        if kind == 0:
+            id = self.add({"opcode": "motion_movesteps"}, parent)
+            add = self.add({"opcode": "operator_add"}, id)
+            self.blocks[add]["inputs"] = {"NUM1": [1, [4, str(index)]],
+                "NUM2": [3, [12, self.variable[1], self.variable[0]], [4, "2"]]}
+            self.blocks[id]["inputs"]["STEPS"] = [3, add, [4, "10"]]
+        elif kind == 1:
+            id = self.add({"opcode": "data_setvariableto",
+                "fields": {"VARIABLE": [self.variable[1], self.variable[0]]}}, parent)
+            self.blocks[id]["inputs"]["VALUE"] = [1, [10, "text %i" % index]]
+        elif kind == 2:
+            id = self.add({"opcode": "procedures_call", "mutation": {"tagName": "mutation",
+                "children": [], "proccode": self.proccode,
+                "argumentids": json.dumps(self.argumentIds)}}, parent)
+            self.blocks[id]["inputs"][self.argumentIds[0]] = [1, [10, "call %i" % index]]
+        else:
+            id = self.add({"opcode": "looks_gotofrontback", "fields": {"FRONT_BACK": ["front", None]}}, parent)
+        return id
+
+    def addAsset(self, data, format):
+        """Stores asset data and returns its md5."""
+        md5 = hashlib.md5(data).hexdigest()
+        self.assets[md5 + "." + format] = data
+        return md5
+
+    def sound(self, index):
+        """Returns a sound with a stereo 16 bit 44.1kHz sine wave."""
+        rate = 44100
+        count = rate * self.soundSeconds
+        pitch = 220 * (index + 1)
+        frames = bytearray()
+        for i in range(count):
+            sample = int(8000 * math.sin(2 * math.pi * pitch * i / rate))
+            frames += struct.pack("<hh", sample, sample)
+        data = wav(bytes(frames), 2, 2, rate)
+        md5 = self.addAsset(data, "wav")
+        return {"assetId": md5, "name": "sound%i" % index, "dataFormat": "wav", "format": "",
+            "rate": rate, "sampleCount": count, "md5ext": md5 + ".wav"}
+
+    def costume(self, index):
+        """Returns an svg or bitmap costume."""
+        if index % 2 == 0:
+            data = ('<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="40" viewBox="0 0 %i 40">'
+                '<rect width="%i" height="40" fill="#%06x"/><text x="2" y="30" font-family="Sans Serif">'
+                '%i</text></svg>' % (40 + index, 40 + index, 40 + index, self.random.randrange(1 << 24), index))
+            data, format, resolution = data.encode("utf-8"), "svg", 1
+        else:
+            data, format, resolution = png(64 + index, 64, self.random.randrange(1 << 24)), "png", 2
+        md5 = self.addAsset(data, format)
+        return {"assetId": md5, "name": "costume%i" % index, "bitmapResolution": resolution,
+            "md5ext": md5 + "." + format, "dataFormat": format, "rotationCenterX": 20, "rotationCenterY": 20}
+
+def wav(frames, channels, width, rate):
+    """Returns the bytes of a pcm wav file."""
+    header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(frames), b"WAVE", b"fmt ", 16, 1,
+        channels, rate, rate * channels * width, channels * width, width * 8, b"data", len(frames))
+    return header + frames
+
+def png(width, height, color):
+    """Returns the bytes of a png filled with one rgb color."""
+    def chunk(name, data):
+        return struct.pack(">I", len(data)) + name + data + struct.pack(">I", zlib.crc32(name + data))
+    row = b"\x00" + bytes([color >> 16, color >> 8 & 255, color & 255]) * width
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates a synthetic sb3 project for benchmarks.")
+    parser.add_argument("output", help="path to save the sb3 project")
+    parser.add_argument("--size", help="start from a preset size", choices=list(sizes), default="small")
+    for name in sizes["small"]:
+        parser.add_argument("--" + name, type=int, default=None)
+    parser.add_argument("--sound-seconds", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    options = dict(sizes[args.size])
+    for name in options:
+        if getattr(args, name) != None:
+            options[name] = getattr(args, name)
+    count = generate(args.output, soundSeconds=args.sound_seconds, seed=args.seed, **options)
+    print("Saved %i blocks to '%s'" % (count, args.output))
@@ -0,0 +1,225 @@
+# Audio conversion for the sb3 to sb2 converter
+# Uses NumPy when installed, otherwise falls back to audioop
+
+import math, struct
+
+numpy = None # Set by loadEngines if installed
+audioop = None # Removed in Python 3.13
+defaultEngine = None # The best engine found by loadEngines
+loaded = False
+
+qualities = ["fast", "best"] # Resampling modes, fast is linear interpolation like audioop
+
+def loadEngines():
+    """Imports numpy and audioop if they are installed.
+
+    Importing numpy takes longer than converting most projects, so it
+    is only done once a sound needs converting. Returns defaultEngine."""
+    global numpy, audioop, defaultEngine, loaded
+    if not loaded:
+        try:
+            import numpy
+        except ImportError:
+            pass
+        try:
+            import audioop
+        except ImportError:
+            pass
+
+        if numpy:
+            defaultEngine = "numpy"
+        elif audioop:
+            defaultEngine = "audioop"
+        loaded = True
+    return defaultEngine
+
+def convert(frames, channels, width, rate, newRate, newWidth, quality="fast", engine=None):
+    """Converts pcm wav frames to mono with a new rate and sample width.
+
+    frames -- the raw little endian frames, 8 bit samples are unsigned
+    channels -- the number of interleaved channels
+    width -- the sample width in bytes
+    rate, newRate -- the sample rate of the frames and of the result
+    newWidth -- the sample width in bytes of the result
+    quality -- "best" filters before downsampling, "fast" does not and is faster
+    engine -- force "numpy" or "audioop", defaults to the best available
+
+    Channels are summed like audioop.tomono(frames, width, 1, 1)."""
+    loadEngines()
+    engine = engine or defaultEngine
+    if not quality in qualities:
+        raise ValueError("Unkown resampling quality '%s'." % quality)
+    if engine == "numpy" and numpy:
+        return _convertNumpy(frames, channels, width, rate, newRate, newWidth, quality)
+    elif engine == "audioop" and audioop:
+        return _convertAudioop(frames, channels, width, rate, newRate, newWidth)
+    raise RuntimeError("Converting sounds requires numpy, or audioop before Python 3.13.")
+
+def readHeader(stream):
+    """Reads the fmt and data chunk headers of a RIFF wav from a file object.
+
+    Stops at the start of the frames, so nothing after the headers is read.
+    Returns a dict with the format tag, channels, rate, width and
+    sampleCount. Extensible wavs report the format tag of their subformat.
+    Raises ValueError if the headers are invalid."""
+    riff = stream.read(12)
+    if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+        raise ValueError("Not a RIFF wav file.")
+
+    header = None
+    while True:
+        chunk = stream.read(8)
+        if len(chunk) < 8:
+            raise ValueError("Missing wav data chunk.")
+        name = chunk[:4]
+        size = struct.unpack("<I", chunk[4:])[0]
+        padded = size + size % 2 # Chunks are word aligned
+
+        if name == b"fmt ":
+            if size < 16:
+                raise ValueError("Invalid wav fmt chunk.")
+            body = memoryview(stream.read(padded))
+            if len(body) < 16:
+                raise ValueError("Truncated wav fmt chunk.")
+            tag, channels, rate, byteRate, align, bits = struct.unpack_from("<HHIIHH", body)
+            if tag == 0xFFFE and size >= 26 and len(body) >= 26:
+                tag = struct.unpack_from("<H", body, 24)[0] # Extensible subformat
+            header = {"format": tag, "channels": channels, "rate": rate,
+                "width": (bits + 7) // 8, "align": align}
+        elif name == b"data":
+            if not header or not header["align"]:
+                raise ValueError("Missing wav fmt chunk.")
+            header["sampleCount"] = size // header["align"]
+            return header
+        else:
+            stream.seek(padded, 1)
+
+def decode(frames, width):
+    """Returns the samples in frames as a float array.
+
+    Samples up to 16 bit fit in float32, wider ones use float64."""
+    if width == 1:
+        samples = numpy.frombuffer(frames, numpy.uint8).astype(numpy.float32) - 128
+    elif width == 2:
+        samples = numpy.frombuffer(frames, "<i2").astype(numpy.float32)
+    elif width == 3:
+        data = numpy.frombuffer(frames, numpy.uint8)
+        data = data[:len(data) - len(data) % 3].reshape(-1, 3).astype(numpy.int32)
+        samples = data[:, 0] | (data[:, 1] << 8) | (data[:, 2] << 16)
+        samples = numpy.where(samples >= 1 << 23, samples - (1 << 24), samples)
+        samples = samples.astype(numpy.float64)
+    elif width == 4:
+        samples = numpy.frombuffer(frames, "<i4").astype(numpy.float64)
+    else:
+        raise ValueError("Unsupported sample width %i." % width)
+    return samples
+
+def encode(samples, width):
+    """Returns float samples as clipped and rounded frames."""
+    limit = 1 << (8 * width - 1)
+    samples = numpy.clip(numpy.rint(samples), -limit, limit - 1)
+    if width == 1:
+        return (samples + 128).astype(numpy.uint8).tobytes()
+    elif width == 2:
+        return samples.astype("<i2").tobytes()
+    elif width == 3:
+        samples = samples.astype(numpy.int32)
+        data = numpy.empty((len(samples), 3), numpy.uint8)
+        data[:, 0] = samples & 0xFF
+        data[:, 1] = (samples >> 8) & 0xFF
+        data[:, 2] = (samples >> 16) & 0xFF
+        return data.tobytes()
+    elif width == 4:
+        return samples.astype("<i4").tobytes()
+    raise ValueError("Unsupported sample width %i." % width)
+
+def toMono(samples, channels):
+    """Sums interleaved channels into one."""
+    if channels == 1:
+        return samples
+    count = len(samples) // channels
+    mono = samples[0:count * channels:channels].copy()
+    for c in range(1, channels):
+        mono += samples[c:count * channels:channels]
+    return mono
+
+def resample(samples, rate, newRate, quality="fast"):
+    """Resamples float samples with linear interpolation.
+
+    In best quality a windowed sinc filter removes frequencies above
+    the new nyquist frequency before downsampling."""
+    if rate == newRate or not len(samples):
+        return samples
+    if quality == "best" and newRate < rate:
+        samples = lowPass(samples, newRate / rate)
+
+    # Every up output samples use the same offsets into down input samples
+    count = len(samples) * newRate // rate
+    gcd = math.gcd(rate, newRate)
+    up, down = newRate // gcd, rate // gcd
+    positions = numpy.arange(up) * down
+    index = positions // up
+    fraction = (positions % up / up).astype(samples.dtype)
+
+    # Pad with the last sample so every row is complete
+    rows = -(-count // up)
+    padded = numpy.empty(rows * down + 1, samples.dtype)
+    used = min(len(samples), len(padded))
+    padded[:used] = samples[:used]
+    padded[used:] = samples[-1]
+
+    a = padded[:rows * down].reshape(rows, down)[:, index]
+    b = padded[1:rows * down + 1].reshape(rows, down)[:, index]
+    return (a + (b - a) * fraction).ravel()[:count]
+
+def lowPass(samples, ratio, zeros=16, group=64):
+    """Filters out frequencies above ratio times the nyquist frequency.
+
+    Convolves with the fft by overlap-add, group blocks at a time, which
+    is faster than numpy.convolve for long tracks and kernels."""
+    half = int(zeros / ratio)
+    n = numpy.arange(-half, half + 1)
+    kernel = ratio * numpy.sinc(ratio * n) * numpy.blackman(len(n))
+    kernel = (kernel / kernel.sum()).astype(samples.dtype)
+
+    # Each block of step samples is filtered into step + len(kernel) - 1
+    size = 1 << max(11, (4 * len(kernel)).bit_length())
+    step = size - len(kernel) + 1
+    spectrum = numpy.fft.rfft(kernel, size)
+    blocks = -(-len(samples) // step)
+    output = numpy.zeros((blocks + 1) * step, samples.dtype)
+    for start in range(0, blocks, group):
+        end = min(start + group, blocks)
+        chunk = numpy.zeros((end - start) * step, samples.dtype)
+        part = samples[start * step:end * step]
+        chunk[:len(part)] = part
+        filtered = numpy.fft.irfft(numpy.fft.rfft(chunk.reshape(-1, step), size) * spectrum, size)
+
+        # Add each block's tail to the start of the next
+        output[start * step:end * step] += filtered[:, :step].ravel()
+        tails = output[(start + 1) * step:(end + 1) * step].reshape(-1, step)
+        tails[:, :len(kernel) - 1] += filtered[:, step:]
+    return output[half:half + len(samples)]
+
+def _convertNumpy(frames, channels, width, rate, newRate, newWidth, quality):
+    samples = decode(frames, width)
+    samples = toMono(samples, channels)
+    samples = resample(samples, rate, newRate, quality)
+    if newWidth != width:
+        samples = samples * 2.0 ** (8 * (newWidth - width))
+    return encode(samples, newWidth)
+
+def _convertAudioop(frames, channels, width, rate, newRate, newWidth):
+    if width == 1:
+        frames = audioop.bias(frames, 1, -128) # audioop uses signed 8 bit
+    if channels == 2:
+        frames = audioop.tomono(frames, width, 1, 1)
+    elif channels > 2:
+        raise ValueError("audioop can not downmix %i channels." % channels)
+    if rate != newRate:
+        frames = audioop.ratecv(frames, width, 1, rate, newRate, None)[0]
+    if newWidth != width:
+        frames = audioop.lin2lin(frames, width, newWidth)
+    if newWidth == 1:
+        frames = audioop.bias(frames, 1, 128)
+    return frames
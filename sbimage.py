@@ -0,0 +1,96 @@
+# Bitmap costume conversion for the sb3 to sb2 converter
+# Uses Pillow when installed to downscale, recompressing only needs zlib
+
+import io, struct, zlib
+
+Image = None # Set by loadPillow if installed
+loaded = False
+
+version = 1 # Change when converted bitmaps are different
+
+signature = b"\x89PNG\r\n\x1a\n"
+
+def loadPillow():
+    """Imports Pillow the first time it is needed and returns its Image module, or None."""
+    global Image, loaded
+    if not loaded:
+        try:
+            from PIL import Image
+        except ImportError:
+            pass
+        loaded = True
+    return Image
+
+def convert(data, level=None, downscale=False):
+    """Shrinks png data by downscaling and recompressing it.
+
+    level -- deflate the image data again at this level from 0 to 9
+    downscale -- halve the size of the image, this needs Pillow
+
+    Returns the new data and whether it was downscaled, or None if the
+    result would not be smaller. Raises ValueError for invalid pngs."""
+    scaled = False
+    result = data
+    if downscale and loadPillow():
+        result = halve(result, level)
+        scaled = True
+    elif level != None:
+        result = recompress(result, level)
+    if len(result) >= len(data):
+        return None
+    return result, scaled
+
+def halve(data, level=None):
+    """Returns png data resized to half the width and height, rounded up."""
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError("Invalid png: %s" % e)
+    if image.mode == "P" or image.mode == "LA" or image.mode == "L" and "transparency" in image.info:
+        image = image.convert("RGBA") # Resample colors, not palette indexes
+    size = ((image.width + 1) // 2, (image.height + 1) // 2)
+    image = image.resize(size, Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, "png", compress_level=6 if level == None else level)
+    return output.getvalue()
+
+def recompress(data, level):
+    """Returns the png with its image data deflated again in one chunk."""
+    chunks = readChunks(data)
+    try:
+        pixels = zlib.decompress(b"".join(body for name, body in chunks if name == b"IDAT"))
+    except zlib.error as e:
+        raise ValueError("Invalid png data: %s" % e)
+    pixels = zlib.compress(pixels, level)
+
+    output = [signature]
+    for name, body in chunks:
+        if name == b"IDAT":
+            if pixels:
+                output.append(writeChunk(b"IDAT", pixels))
+                pixels = None # Only the first IDAT holds the new data
+        else:
+            output.append(writeChunk(name, body))
+    return b"".join(output)
+
+def readChunks(data):
+    """Returns the (name, body) of each chunk in png data."""
+    if data[:8] != signature:
+        raise ValueError("Not a png file.")
+    chunks = []
+    index = 8
+    while index + 8 <= len(data):
+        size, name = struct.unpack_from(">I4s", data, index)
+        body = data[index + 8:index + 8 + size]
+        if len(body) != size:
+            raise ValueError("Truncated png chunk.")
+        chunks.append((name, body))
+        index += 12 + size
+        if name == b"IEND":
+            break
+    return chunks
+
+def writeChunk(name, body):
+    return struct.pack(">I4s", len(body), name) + body + struct.pack(">I", zlib.crc32(name + body))
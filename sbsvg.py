@@ -0,0 +1,192 @@
+# SVG costume conversion for the sb3 to sb2 converter
+# Rewrites Scratch 3 vector costumes while streaming, so no DOM is built
+
+import io, re
+from xml.parsers import expat
+
+version = 2 # Change when converted svgs are different
+
+fonts = { # Scratch 3 fonts and the closest Scratch 2 font
+    "sans serif": "Helvetica",
+    "serif": "Donegal",
+    "handwriting": "Gloria",
+    "marker": "Marker",
+    "curly": "Mystery",
+    "pixel": "Scratch",
+    "scratch": "Scratch"
+}
+
+def convert(stream, bufferSize=64 * 1024):
+    """Rewrites a Scratch 3 svg from a binary file object for Scratch 2.
+
+    Fonts are renamed to Scratch 2 fonts and the content is moved so the
+    viewBox starts at 0,0, as Scratch 2 ignores where the viewBox starts.
+    Width and height are set from the viewBox.
+
+    Returns the new svg bytes and the x and y the content was moved back
+    by, which must be taken from the rotation center too, or None if
+    nothing needed changing. Raises ValueError if the svg is not valid xml."""
+    writer = Writer()
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    writer.bind(parser)
+    try:
+        chunk = stream.read(bufferSize)
+        while chunk:
+            parser.Parse(chunk, False)
+            chunk = stream.read(bufferSize)
+        parser.Parse(b"", True)
+    except expat.ExpatError as e:
+        raise ValueError("Invalid svg: %s" % e)
+    if not writer.changed:
+        return None
+    return writer.output.getvalue().encode("utf-8"), writer.offset
+
+def escape(text):
+    """Escapes xml text, like xml.sax.saxutils which is slow to import."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def quoteattr(text):
+    """Escapes and quotes an xml attribute value like xml.sax.saxutils."""
+    text = escape(text).replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#9;")
+    if '"' in text:
+        if "'" in text:
+            return '"%s"' % text.replace('"', "&quot;")
+        return "'%s'" % text
+    return '"%s"' % text
+
+class Writer:
+    """Writes parser events back out as xml, rewriting what Scratch 2 needs."""
+
+    numbers = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+    fontStyle = re.compile(r"(font-family\s*:\s*)([^;]+)")
+
+    def __init__(self):
+        self.output = io.StringIO() # The svg text
+        self.depth = 0
+        self.pending = False # A start tag is waiting for its ">" or "/>"
+        self.cdata = False
+        self.translated = False # The content is in a translated group
+        self.offset = (0, 0) # Where the viewBox started before it was moved to 0,0
+        self.changed = False
+
+    def bind(self, parser):
+        parser.XmlDeclHandler = self.xmlDecl
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.instruction
+        parser.StartCdataSectionHandler = self.startCdata
+        parser.EndCdataSectionHandler = self.endCdata
+
+    def write(self, text):
+        """Adds text to the output, finishing a waiting start tag."""
+        if self.pending:
+            self.output.write(">")
+            self.pending = False
+        self.output.write(text)
+
+    def xmlDecl(self, version, encoding, standalone):
+        # The output is always utf-8
+        self.write('<?xml version="%s" encoding="UTF-8"?>' % (version or "1.0"))
+
+    def startElement(self, name, attributes):
+        attributes = [(attributes[i], attributes[i + 1]) for i in range(0, len(attributes), 2)]
+        if self.depth == 0 and name == "svg":
+            attributes = self.fixRoot(attributes)
+        attributes = [(key, self.fixFonts(key, value)) for key, value in attributes]
+
+        self.write("<" + name)
+        for key, value in attributes:
+            self.output.write(" %s=%s" % (key, quoteattr(value)))
+        self.pending = True
+        self.depth += 1
+
+        if self.depth == 1 and self.translated:
+            # Move everything inside the svg so the viewBox starts at 0,0
+            self.write('<g transform="translate(%s, %s)">' % self.translated)
+
+    def endElement(self, name):
+        self.depth -= 1
+        if self.depth == 0 and self.translated:
+            self.write("</g>")
+        if self.pending:
+            self.output.write("/>")
+            self.pending = False
+        else:
+            self.output.write("</%s>" % name)
+
+    def characters(self, data):
+        if self.cdata:
+            self.write(data)
+        else:
+            self.write(escape(data))
+
+    def comment(self, data):
+        self.write("<!--%s-->" % data)
+
+    def instruction(self, target, data):
+        self.write("<?%s %s?>" % (target, data))
+
+    def startCdata(self):
+        self.write("<![CDATA[")
+        self.cdata = True
+
+    def endCdata(self):
+        self.write("]]>")
+        self.cdata = False
+
+    def fixRoot(self, attributes):
+        """Returns the svg attributes with the viewBox at 0,0 and a size."""
+        values = dict(attributes)
+        if not "viewBox" in values:
+            return attributes
+        box = self.numbers.findall(values["viewBox"])
+        if len(box) != 4:
+            return attributes
+        x, y, width, height = box
+
+        fixed = {}
+        if float(x) or float(y):
+            self.translated = (self.negate(x), self.negate(y))
+            self.offset = (float(x), float(y))
+            fixed["viewBox"] = "0 0 %s %s" % (width, height)
+        for key, value in [("width", width), ("height", height)]:
+            # Scratch 2 needs a size in pixels matching the viewBox
+            size = values.get(key, "").strip()
+            number = self.numbers.match(size)
+            if not number or size[number.end():] not in ["", "px"] or float(number.group()) != float(value):
+                fixed[key] = value
+        if not fixed:
+            return attributes
+        self.changed = True
+
+        # Keep the order of the attributes, adding missing ones at the end
+        attributes = [(key, fixed.pop(key, value)) for key, value in attributes]
+        for key in ["width", "height"]:
+            if key in fixed:
+                attributes.append((key, fixed[key]))
+        return attributes
+
+    def negate(self, number):
+        if number.startswith("-"):
+            return number[1:]
+        return "-" + number.lstrip("+")
+
+    def fixFonts(self, key, value):
+        """Renames Scratch 3 fonts in a font-family or style attribute."""
+        if key == "font-family":
+            return self.fixFont(value)
+        elif key == "style" and "font-family" in value:
+            return self.fontStyle.sub(lambda m: m.group(1) + self.fixFont(m.group(2)), value)
+        return value
+
+    def fixFont(self, family):
+        """Returns a font-family with the first Scratch 3 font renamed."""
+        name = family.split(",")[0].strip().strip("'\"")
+        font = fonts.get(name.lower())
+        if not font or font == name:
+            return family
+        self.changed = True
+        return font